@@ -18,5 +18,18 @@ import client
 import group
 import device
 import app
+import concurrency
+import cache
+import retry
+import ratelimit
+import metrics
+import jsonstream
+import workflow
+import mirror
+import directory
+import deviceindex
+import tenants
+import scheduler
+import transport
 
-__all__ = ['user', 'client', 'group', 'device', 'app']
+__all__ = ['user', 'client', 'group', 'device', 'app', 'concurrency', 'cache', 'retry', 'ratelimit', 'metrics', 'jsonstream', 'workflow', 'mirror', 'directory', 'deviceindex', 'tenants', 'scheduler', 'transport']
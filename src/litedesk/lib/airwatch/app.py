@@ -12,19 +12,56 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from base import BaseObject
+import threading
+
+from base import BaseObject, DEFAULT_PAGE_SIZE, PackedId, get_items
+from concurrency import WorkerPool, deferred
+
+
+class InstallResult(object):
+    """
+    Outcome of installing an app on one device: `status` is 'installed',
+    'skipped' (already installed) or 'failed' with `error` set. `done` of
+    `total` devices are finished when the result is reported.
+    """
+
+    INSTALLED = 'installed'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+
+    def __init__(self, device, status, error=None, done=0, total=0):
+        self.device = device
+        self.status = status
+        self.error = error
+        self.done = done
+        self.total = total
+
+    def __repr__(self):
+        return '<InstallResult {0} {1} ({2}/{3})>'.format(
+            getattr(self.device, 'Udid', None), self.status, self.done, self.total
+        )
 
 
 class App(BaseObject):
+    FIELDS = ('Id', 'ApplicationName', 'BundleId', 'SmartGroups')
+    __slots__ = ('_id', '_catalog') + FIELDS[1:]
+
+    Id = PackedId()
+
+    def __init__(self, client, *args, **kw):
+        self._catalog = None
+        super(App, self).__init__(client, *args, **kw)
+
     @classmethod
     def search(cls, client, **kwargs):
-        endpoint = 'mam/apps/search'
-        response = client.call_api('GET', endpoint, params=kwargs)
-        response.raise_for_status()
-        return [
-            cls(client, **attrs)
-            for attrs in response.json().get('Application')
-        ]
+        items, total = get_items(client, 'mam/apps/search', 'Application', kwargs)
+        return [cls(client, **attrs) for attrs in items]
+
+    @classmethod
+    def iter_search(cls, client, pagesize=DEFAULT_PAGE_SIZE, prefetch=False, **kwargs):
+        return cls._iter_search(
+            client, 'mam/apps/search', 'Application', kwargs, pagesize, prefetch
+        )
 
     def install(self, device):
         endpoint = 'mam/apps/public/{0}/install'.format(self.Id['Value'])
@@ -38,9 +75,41 @@ class App(BaseObject):
             }
         )
         response.raise_for_status()
+        device._add_installed_app(self)
+
+    def install_many(self, devices, skip_installed=True, concurrency=8):
+        """
+        Install the app on many devices with `concurrency` devices handled
+        at a time, checking their inventories first when `skip_installed`
+        is set. Yields an InstallResult per device as they complete;
+        closing the generator stops the installs not started yet.
+        """
+        devices = list(devices)
+
+        def install(device):
+            if skip_installed and self.is_installed_on_device(device):
+                return InstallResult.SKIPPED
+            self.install(device)
+            return InstallResult.INSTALLED
+
+        if not devices:
+            return
+        pool = WorkerPool(min(concurrency, len(devices)))
+        try:
+            for done, (device, future) in enumerate(
+                pool.imap_unordered(install, devices), 1
+            ):
+                error = future.exception()
+                yield InstallResult(
+                    device,
+                    InstallResult.FAILED if error is not None else future.result(),
+                    error, done, len(devices)
+                )
+        finally:
+            pool.shutdown(wait=False)
 
     def is_installed_on_device(self, device):
-        return self.Id in (app.Id for app in device.installed_apps)
+        return self.Id['Value'] in device.installed_app_ids
 
     def _smart_group_change_common(self, smart_group, endpoint):
         response = self._client.call_api(
@@ -55,9 +124,131 @@ class App(BaseObject):
         self._smart_group_change_common(
             smart_group, 'mam/apps/public/{0}/addsmartgroup/{1}'
         )
+        smart_groups = [
+            sg for sg in getattr(self, 'SmartGroups', None) or []
+            if sg['Id'] != smart_group.SmartGroupID
+        ]
+        smart_groups.append(
+            {'Id': smart_group.SmartGroupID, 'Name': smart_group.Name}
+        )
+        self.SmartGroups = smart_groups
+        self._remember('apps', self.Id['Value'])
+        if self._catalog is not None:
+            self._catalog.put(self)
 
     def delete_smart_group(self, smart_group):
         self._smart_group_change_common(
             smart_group, 'mam/apps/public/{0}/deletesmartgroup/{1}'
         )
+        self.SmartGroups = [
+            sg for sg in getattr(self, 'SmartGroups', None) or []
+            if sg['Id'] != smart_group.SmartGroupID
+        ]
+        self._remember('apps', self.Id['Value'])
+        if self._catalog is not None:
+            self._catalog.put(self)
+
+    search_async = deferred('search')
+    install_async = deferred('install')
+    add_smart_group_async = deferred('add_smart_group')
+    delete_smart_group_async = deferred('delete_smart_group')
+
+
+class AppCatalogIndex(object):
+    """
+    Apps of the catalog indexed by app Id and by the SmartGroupID of every
+    smart group they are assigned to, built from one paged app listing.
+    Apps coming from the index keep it up to date when their smart groups
+    are changed with `add_smart_group`/`delete_smart_group`. An unfiltered
+    index starts from the apps snapshot of `client.mirror` when it is
+    younger than `max_age` seconds (the mirror's default when None);
+    `max_age=0` always walks the catalog.
+    """
+
+    def __init__(self, client, max_age=None, **search_kwargs):
+        self._client = client
+        self._search_kwargs = search_kwargs
+        self._apps = {}
+        self._by_smart_group = {}
+        # smart group ids each app is indexed under, apps change in place
+        self._indexed_under = {}
+        self._lock = threading.RLock()
+        mirror = getattr(client, 'mirror', None)
+        snapshot = None
+        if mirror is not None and not search_kwargs:
+            snapshot = mirror.all('apps', max_age)
+        if snapshot is None:
+            self.refresh()
+        else:
+            for attrs in snapshot:
+                self.put(App(client, **attrs))
+
+    def __len__(self):
+        return len(self._apps)
+
+    def __iter__(self):
+        return iter(self._apps.values())
+
+    def get(self, app_id):
+        return self._apps.get(app_id)
+
+    def apps_for_smart_group(self, smart_group_id):
+        with self._lock:
+            return self._by_smart_group.get(smart_group_id, {}).values()
+
+    def put(self, app):
+        app_id = app.Id['Value']
+        with self._lock:
+            self._discard(app_id)
+            self._apps[app_id] = app
+            smart_group_ids = set(
+                smart_group['Id']
+                for smart_group in getattr(app, 'SmartGroups', None) or []
+            )
+            for smart_group_id in smart_group_ids:
+                self._by_smart_group.setdefault(smart_group_id, {})[app_id] = app
+            self._indexed_under[app_id] = smart_group_ids
+        app._catalog = self
+
+    def _discard(self, app_id):
+        self._apps.pop(app_id, None)
+        for smart_group_id in self._indexed_under.pop(app_id, ()):
+            apps = self._by_smart_group.get(smart_group_id, {})
+            apps.pop(app_id, None)
+            if not apps:
+                self._by_smart_group.pop(smart_group_id, None)
+
+    def refresh(self):
+        """
+        Walk the catalog again and apply the changes in place: new and
+        changed apps are re-indexed, apps gone from the catalog dropped.
+        """
+        seen = set()
+        for app in App.iter_search(self._client, **self._search_kwargs):
+            seen.add(app.Id['Value'])
+            self.put(app)
+        with self._lock:
+            for app_id in set(self._apps) - seen:
+                self._discard(app_id)
+        mirror = getattr(self._client, 'mirror', None)
+        if mirror is not None and not self._search_kwargs:
+            mirror.replace('apps', [
+                (app_id, self._apps[app_id].fields()) for app_id in seen
+            ])
+
+    def refresh_app(self, app_id):
+        endpoint = 'mam/apps/public/{0}'.format(app_id)
+        response = self._client.call_api('GET', endpoint)
+        if response.status_code == 404:
+            with self._lock:
+                self._discard(app_id)
+            mirror = getattr(self._client, 'mirror', None)
+            if mirror is not None:
+                mirror.remove('apps', app_id)
+            return None
+        response.raise_for_status()
+        app = App(self._client, **response.json())
+        app._remember('apps', app_id)
+        self.put(app)
+        return app
 
@@ -14,8 +14,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
+
 import requests
 
+from concurrency import Future
+from jsonstream import iter_response_array
+
+
+DEFAULT_PAGE_SIZE = 500
+
 
 def check_response(exception_to_raise=None):
     def decorator(func):
@@ -34,8 +42,190 @@ def check_response(exception_to_raise=None):
     return decorator
 
 
+def get_items(client, endpoint, key, params=None):
+    """
+    GET `endpoint` and return the items listed under `key` and the reported
+    `Total`. When the client streams, the items are a generator parsing the
+    body as it downloads and the total is None.
+    """
+    stream = getattr(client, 'stream', False)
+    if stream:
+        response = client.call_api('GET', endpoint, params=params, stream=True)
+    else:
+        response = client.call_api('GET', endpoint, params=params)
+    try:
+        response.raise_for_status()
+    except Exception:
+        response.close()
+        raise
+    if response.status_code == 204:
+        response.close()
+        return [], 0
+    if stream:
+        return iter_response_array(response, key), None
+    if not response.content:
+        return [], 0
+    body = response.json()
+    return body.get(key) or [], body.get('Total')
+
+
+def _fetch_page(client, endpoint, key, params, page, pagesize):
+    return get_items(
+        client, endpoint, key, dict(params, page=page, pagesize=pagesize)
+    )
+
+
+def _prefetch_page(*args):
+    future = Future()
+    thread = threading.Thread(target=future.run, args=(_fetch_page, ) + args)
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+def iter_pages(client, endpoint, key, params=None,
+               pagesize=DEFAULT_PAGE_SIZE, prefetch=False):
+    """
+    Yield the items listed under `key` on every page of a search endpoint,
+    walking `page` until the reported `Total` is exhausted. With `prefetch`
+    the next page is requested while the current one is being consumed;
+    streamed pages are not prefetched since their total is not known
+    before they have been read.
+    """
+    params = dict(params or {})
+    page, seen = 0, 0
+    next_page = None
+    while True:
+        if next_page is not None:
+            items, total = next_page.result()
+        else:
+            items, total = _fetch_page(client, endpoint, key, params, page, pagesize)
+        next_page = None
+        if prefetch and total is not None and items and seen + len(items) < total:
+            next_page = _prefetch_page(
+                client, endpoint, key, params, page + 1, pagesize
+            )
+        count = 0
+        for item in items:
+            count += 1
+            yield item
+        seen += count
+        if total is None:
+            has_more = count >= pagesize
+        else:
+            has_more = count > 0 and seen < total
+        if not has_more:
+            return
+        page += 1
+
+
+class _Unpacked(object):
+    __slots__ = ('value', )
+
+    def __init__(self, value):
+        self.value = value
+
+
+class PackedId(object):
+    """
+    `Id` field stored as its bare value. AirWatch wraps ids as
+    `{'Value': 42}`; the wrapper is only rebuilt when the field is read.
+    """
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            value = instance._id
+        except AttributeError:
+            raise AttributeError('Id')
+        if isinstance(value, _Unpacked):
+            return value.value
+        return {'Value': value}
+
+    def __set__(self, instance, value):
+        if isinstance(value, dict) and value.keys() == ['Value']:
+            instance._id = value['Value']
+        else:
+            instance._id = _Unpacked(value)
+
+    def __delete__(self, instance):
+        del instance._id
+
+
 class BaseObject(object):
+    """
+    Model built from an API response. Fields listed in `FIELDS` live in
+    slots (`Id` packed by PackedId), anything else the API returns goes
+    to one `_extra` dict created on demand. All of them read and write as
+    plain attributes.
+    """
+
+    __slots__ = ('_client', '_extra')
+
+    FIELDS = ()
+
     def __init__(self, client, *args, **kw):
         self._client = client
+        self._extra = None
         for k, v in kw.items():
             setattr(self, k, v)
+
+    def __setattr__(self, name, value):
+        try:
+            object.__setattr__(self, name, value)
+        except AttributeError:
+            if self._extra is None:
+                object.__setattr__(self, '_extra', {})
+            self._extra[name] = value
+
+    def __getattr__(self, name):
+        # only reached when the slots have no value for name
+        if name != '_extra':
+            extra = self._extra
+            if extra is not None and name in extra:
+                return extra[name]
+        raise AttributeError(name)
+
+    def __delattr__(self, name):
+        try:
+            object.__delattr__(self, name)
+        except AttributeError:
+            if self._extra is None or name not in self._extra:
+                raise
+            del self._extra[name]
+
+    def fields(self):
+        """The API fields held by the object, as a dict."""
+        result = {}
+        for name in self.FIELDS:
+            try:
+                result[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        if self._extra:
+            result.update(self._extra)
+        return result
+
+    def __getstate__(self):
+        # the client does not travel, unpickled objects are detached
+        return self.fields()
+
+    def __setstate__(self, state):
+        self.__init__(None, **state)
+
+    def _remember(self, kind, key):
+        mirror = getattr(self._client, 'mirror', None)
+        if mirror is not None:
+            mirror.put(kind, key, self.fields())
+
+    def _forget(self, kind, key):
+        mirror = getattr(self._client, 'mirror', None)
+        if mirror is not None:
+            mirror.remove(kind, key)
+
+    @classmethod
+    def _iter_search(cls, client, endpoint, key, params,
+                     pagesize=DEFAULT_PAGE_SIZE, prefetch=False):
+        for attrs in iter_pages(client, endpoint, key, params, pagesize, prefetch):
+            yield cls(client, **attrs)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Offline benchmarks of representative workflows against FakeAirWatch.
+
+    python benchmark.py --latency 0.005 --users 200 --concurrency 16
+    python benchmark.py --memory 10000
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from app import App
+from client import Client
+from device import Device
+from fakeserver import FakeAirWatch, FakeAirWatchServer
+from group import UserGroup, UserGroupHacked
+from user import User
+from workflow import OnboardingPipeline
+
+
+def _onboarding(fake, client, options):
+    usernames = ['hire{0}'.format(i) for i in xrange(options.users)]
+
+    def run():
+        User.create_many(client, usernames, concurrency=options.concurrency)
+        User.activate_many(client, usernames, concurrency=options.concurrency)
+    return run
+
+
+def _onboarding_pipeline(fake, client, options):
+    fake.populate(user_groups=1)
+    group = UserGroup.get_remote(client, 'group0')
+    usernames = ['hire{0}'.format(i) for i in xrange(options.users)]
+
+    def run():
+        pipeline = OnboardingPipeline(
+            client, group,
+            concurrency=dict.fromkeys(OnboardingPipeline.STAGES, options.concurrency)
+        )
+        for _ in pipeline.run(usernames):
+            pass
+    return run
+
+
+def _group_sync(fake, client, options):
+    fake.populate(users=options.users, user_groups=1)
+    group = UserGroup.get_remote(client, 'group0')
+    users = list(User.iter_search(client))
+
+    def run():
+        for user in users:
+            group.add_member(user)
+    return run
+
+
+def _smart_group_replacement(fake, client, options):
+    fake.populate(
+        users=options.users, user_groups=1, smart_groups=options.smart_groups,
+        apps=options.apps
+    )
+    group = UserGroupHacked.get_remote(client, 'group0')
+    user = User.get_remote(client, 'user0')
+
+    def run():
+        group.add_member(user)
+    return run
+
+
+def _catalog_scan(fake, client, options):
+    fake.populate(apps=options.apps * 10)
+
+    def run():
+        for _ in App.iter_search(client, pagesize=100):
+            pass
+    return run
+
+
+WORKFLOWS = [
+    ('onboarding', _onboarding),
+    ('onboarding_pipeline', _onboarding_pipeline),
+    ('group_sync', _group_sync),
+    ('smart_group_replacement', _smart_group_replacement),
+    ('catalog_scan', _catalog_scan),
+]
+
+
+def run_workflow(setup, options):
+    """Set up a fresh tenant, run one workflow and return its numbers."""
+    fake = FakeAirWatch(
+        latency=options.latency, error_rate=options.error_rate,
+        throttle_rate=options.throttle_rate, retry_after=0, seed=0
+    )
+    with FakeAirWatchServer(fake) as server:
+        client = Client(server.url, 'admin', 'secret', 'token')
+        run = setup(fake, client, options)
+        fake.reset_counters()
+        started = time.time()
+        run()
+        wall = time.time() - started
+        client.close()
+    return {
+        'wall': wall,
+        'requests': fake.request_count,
+        'rps': fake.request_count / wall if wall else 0.0,
+        'by_endpoint': dict(fake.requests),
+    }
+
+
+class _DictObject(object):
+    # how models stored API fields before they had slots
+    def __init__(self, client, *args, **kw):
+        self._client = client
+        for k, v in kw.items():
+            setattr(self, k, v)
+
+
+def _deep_size(obj, seen):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(k, seen) + _deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_deep_size(item, seen) for item in obj)
+    elif not isinstance(obj, basestring):
+        if hasattr(obj, '__dict__'):
+            size += _deep_size(obj.__dict__, seen)
+        for cls in type(obj).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                value = getattr(obj, name, None)
+                if value is not None:
+                    size += _deep_size(value, seen)
+    return size
+
+
+def measure_memory(count):
+    """Bytes per Device built from a fleet listing, before and after slots."""
+    fake = FakeAirWatch()
+    fake.populate(users=100, devices=count)
+    body = json.dumps(fake._devices_search({'pagesize': count}, {})[1])
+    results = {}
+    for name, cls in (('dict', _DictObject), ('slots', Device)):
+        objects = [cls(None, **attrs) for attrs in json.loads(body)['Devices']]
+        # the client is shared, the parsed strings are the same in both cases
+        seen = set([id(None)])
+        results[name] = _deep_size(objects, seen) / float(count)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--smart-groups', type=int, default=5)
+    parser.add_argument('--apps', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--memory', type=int, metavar='OBJECTS',
+                        help='only measure the memory used by OBJECTS devices')
+    parser.add_argument('workflows', nargs='*', metavar='workflow',
+                        help='subset of: {0}'.format(', '.join(n for n, _ in WORKFLOWS)))
+    options = parser.parse_args(argv)
+
+    if options.memory:
+        result = measure_memory(options.memory)
+        print 'bytes per device: {0:.0f} with __dict__, {1:.0f} with __slots__'.format(
+            result['dict'], result['slots']
+        )
+        return
+
+    print '{0:<26}{1:>10}{2:>10}{3:>12}'.format('workflow', 'wall [s]', 'requests', 'requests/s')
+    for name, setup in WORKFLOWS:
+        if options.workflows and name not in options.workflows:
+            continue
+        result = run_workflow(setup, options)
+        print '{0:<26}{1:>10.3f}{2:>10}{3:>12.1f}'.format(
+            name, result['wall'], result['requests'], result['rps']
+        )
+        if options.verbose:
+            for endpoint, count in sorted(result['by_endpoint'].items()):
+                print '    {0:<56}{1:>8}'.format(endpoint, count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def resource_of(endpoint):
+    """
+    Resource an endpoint belongs to: its first two path segments, e.g.
+    `system/usergroups` for `system/usergroups/12/users`.
+    """
+    return '/'.join(endpoint.strip('/').split('/')[:2])
+
+
+class ResponseCache(object):
+    """
+    LRU cache of GET responses keyed by endpoint and params.
+
+    Entries expire after `ttl` seconds, or after the value in `ttls` for
+    the longest matching endpoint prefix. The cache holds at most
+    `max_bytes` of response bodies. A mutating call invalidates every
+    entry of the same resource and of the resources listed in `RELATED`.
+    """
+
+    # app installs show up in device inventories, user group changes in
+    # the smart groups built on them
+    RELATED = {
+        'mam/apps': ('mdm/devices', ),
+        'system/usergroups': ('mdm/smartgroups', ),
+    }
+
+    def __init__(self, ttl=60, ttls=None, max_bytes=32 * 1024 * 1024):
+        self.ttl = ttl
+        self.ttls = dict((k.strip('/'), v) for k, v in (ttls or {}).items())
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped on invalidation, lets derived state know it is outdated
+        self._generation = 0
+        self._generations = {}
+
+    @staticmethod
+    def _key(endpoint, params):
+        return endpoint.strip('/'), json.dumps(params or {}, sort_keys=True)
+
+    def ttl_for(self, endpoint):
+        endpoint = endpoint.strip('/')
+        prefixes = [p for p in self.ttls if endpoint.startswith(p)]
+        if not prefixes:
+            return self.ttl
+        return self.ttls[max(prefixes, key=len)]
+
+    def _pop(self, key):
+        response, expires = self._entries.pop(key)
+        self.size -= len(response.content)
+
+    def get(self, endpoint, params=None):
+        key = self._key(endpoint, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.time():
+                if entry is not None:
+                    self._pop(key)
+                self.misses += 1
+                return None
+            self._entries[key] = self._entries.pop(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, endpoint, params, response):
+        size = len(response.content)
+        if size > self.max_bytes:
+            return
+        key = self._key(endpoint, params)
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (response, time.time() + self.ttl_for(endpoint))
+            self.size += size
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def generation(self, endpoint):
+        """Changes whenever the resource of `endpoint` is invalidated."""
+        resource = resource_of(endpoint)
+        with self._lock:
+            return self._generation, self._generations.get(resource, 0)
+
+    def invalidate(self, endpoint=None):
+        with self._lock:
+            if endpoint is None:
+                self._entries.clear()
+                self.size = 0
+                self._generation += 1
+                return
+            resource = resource_of(endpoint)
+            resources = (resource, ) + self.RELATED.get(resource, ())
+            for name in resources:
+                self._generations[name] = self._generations.get(name, 0) + 1
+            for key in [k for k in self._entries if resource_of(k[0]) in resources]:
+                self._pop(key)
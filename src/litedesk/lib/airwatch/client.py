@@ -15,15 +15,52 @@
 # limitations under the License.
 
 import json
+import sys
+import threading
 import time
+from contextlib import contextmanager
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from concurrency import WorkerPool, gather
+from retry import RetryPolicy
+
+
+class _Flight(object):
+    # one GET in progress, shared by every caller asking for the same thing
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.exc_info = None
 
 
 class Client(object):
-    def __init__(self, server_url, username, password, api_token):
+    def __init__(self, server_url, username, password, api_token, cache=None,
+                 retry_policy=None, rate_limiter=None, hooks=(), stream=False,
+                 mirror=None, single_flight=True, scheduler=None,
+                 transport=None):
         self.server_url = server_url
         self.token = api_token
+        self.cache = cache
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.hooks = list(hooks)
+        # parse large listings incrementally while they download
+        self.stream = stream
+        # TenantMirror answering get_remote lookups, see mirror.py
+        self.mirror = mirror
+        # UserDirectory set once loaded, see directory.py
+        self.user_directory = None
+        # concurrent identical GETs share one request
+        self.single_flight = single_flight
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self.flights = 0
+        self.coalesced = 0
+        # RequestScheduler sharing connection slots by traffic class
+        self.scheduler = scheduler
+        self._local = threading.local()
         self._session = requests.Session()
         self._session.auth = (username, password)
         self._session.headers.update({
@@ -31,28 +68,194 @@ class Client(object):
             'Accept': 'application/json',
             'Content-Type': 'application/json'
             })
+        # sends the HTTP requests, see transport.py
+        self.transport = transport if transport is not None else self._session
 
-    def call_api(self, method, endpoint, data=None, **kw):
+    def call_api(self, method, endpoint, data=None, priority=None, **kw):
+        if priority is not None:
+            with self.priority(priority):
+                return self.call_api(method, endpoint, data, **kw)
         if data is not None:
             kw['data'] = json.dumps(data)
 
+        if method != 'GET':
+            try:
+                return self._call(method, endpoint, **kw)
+            finally:
+                if self.single_flight:
+                    # GETs started before the change must not be joined after it
+                    with self._flights_lock:
+                        self._flights.clear()
+        # streamed or otherwise customised GETs are sent on their own
+        if not self.single_flight or set(kw) - set(['params']):
+            return self._call(method, endpoint, **kw)
+        return self._call_shared(method, endpoint, **kw)
+
+    def _call_shared(self, method, endpoint, **kw):
+        key = endpoint.strip('/'), json.dumps(kw.get('params') or {}, sort_keys=True)
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.flights += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.exc_info is not None:
+                raise flight.exc_info[0], flight.exc_info[1], flight.exc_info[2]
+            return flight.response
+        try:
+            flight.response = self._call(method, endpoint, **kw)
+            # read the body once here, the response is handed to every waiter
+            flight.response.content
+        except Exception:
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._flights_lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+        return flight.response
+
+    def single_flight_stats(self):
+        with self._flights_lock:
+            return {
+                'flights': self.flights,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._flights),
+            }
+
+    def _call(self, method, endpoint, **kw):
+        if self.cache is None or kw.get('stream'):
+            return self._send(method, endpoint, **kw)
+        if method in ('PUT', 'POST', 'DELETE'):
+            try:
+                return self._send(method, endpoint, **kw)
+            finally:
+                self.cache.invalidate(endpoint)
+        response = self.cache.get(endpoint, kw.get('params'))
+        if response is None:
+            response = self._send(method, endpoint, **kw)
+            if response.ok:
+                self.cache.set(endpoint, kw.get('params'), response)
+        return response
+
+    @contextmanager
+    def priority(self, traffic_class):
+        """
+        Send the calls made by this thread inside the block, model methods
+        included, in `traffic_class` of the client's scheduler.
+        """
+        previous = getattr(self._local, 'traffic_class', None)
+        self._local.traffic_class = traffic_class
+        try:
+            yield
+        finally:
+            self._local.traffic_class = previous
+
+    def close(self):
+        self._session.close()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def _send(self, method, endpoint, **kw):
         full_url = '%s/API/v1/%s' % (self.server_url, endpoint)
 
-        request_method = {
-            'GET': self._session.get,
-            'PUT': self._session.put,
-            'POST': self._session.post,
-            'DELETE': self._session.delete
-        }.get(method, self._session.get)
-        return self.__exponential_backoff(request_method, full_url, **kw)
+        if method not in ('GET', 'PUT', 'POST', 'DELETE'):
+            method = 'GET'
 
-    @staticmethod
-    def __exponential_backoff(callable, *args, **kw):
-        for i in xrange(4):
-            time.sleep(pow(2, i) * 0.5 - 0.5)
+        for hook in self.hooks:
+            hook.before_request(method, endpoint, kw)
+        policy = self.retry_policy
+        policy.budget.deposit()
+        started = time.time()
+        attempt = 0
+        while True:
+            response, exc_info = None, None
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            if self.scheduler is not None:
+                self.scheduler.acquire(
+                    getattr(self._local, 'traffic_class', None) or 'default'
+                )
             try:
-                return callable(*args, **kw)
-            except Exception, e:
-                pass
-        else:
-            raise e
\ No newline at end of file
+                response = self.transport.request(method, full_url, **kw)
+            except Exception:
+                exc_info = sys.exc_info()
+            finally:
+                if self.scheduler is not None:
+                    self.scheduler.release()
+            error = exc_info[1] if exc_info is not None else None
+            delay = policy.next_delay(attempt, started, response, error, method)
+            if delay is None:
+                break
+            for hook in self.hooks:
+                hook.on_retry(method, endpoint, attempt, delay, response, error)
+            if response is not None:
+                # give the connection back before waiting, streamed
+                # responses hold it until closed
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+        elapsed = time.time() - started
+        if exc_info is not None:
+            for hook in self.hooks:
+                hook.on_error(method, endpoint, error, elapsed)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        for hook in self.hooks:
+            hook.after_response(method, endpoint, response, elapsed)
+        return response
+
+
+class AsyncClient(Client):
+    """
+    Client running calls on a bounded pool of worker threads.
+
+    `call_api` keeps the blocking contract of `Client`, so every model
+    method works unchanged inside a worker. `call_api_async` and `submit`
+    return `Future` objects, and the `*_async` methods of the models are
+    shortcuts for submitting them. At most `max_in_flight` calls run at
+    once over at most `pool_connections` pooled HTTP connections.
+    """
+
+    def __init__(self, server_url, username, password, api_token,
+                 max_in_flight=10, pool_connections=None, **kw):
+        super(AsyncClient, self).__init__(
+            server_url, username, password, api_token, **kw
+        )
+        pool_connections = pool_connections or max_in_flight
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_connections,
+            pool_block=True
+        )
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._pool = WorkerPool(max_in_flight)
+
+    def submit(self, func, *args, **kw):
+        # the worker sends the call in the traffic class of the submitter
+        traffic_class = getattr(self._local, 'traffic_class', None)
+        if traffic_class is None:
+            return self._pool.submit(func, *args, **kw)
+
+        def call():
+            with self.priority(traffic_class):
+                return func(*args, **kw)
+        return self._pool.submit(call)
+
+    def call_api_async(self, method, endpoint, data=None, **kw):
+        return self.submit(self.call_api, method, endpoint, data, **kw)
+
+    @staticmethod
+    def gather(futures, return_exceptions=False):
+        return gather(futures, return_exceptions=return_exceptions)
+
+    def close(self):
+        self._pool.shutdown()
+        super(AsyncClient, self).close()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import threading
+import Queue
+
+
+class Future(object):
+    """
+    Result of a call running on a WorkerPool. `result()` blocks until the
+    call is done and re-raises its exception with the original traceback.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError('Future not done after {0}s'.format(timeout))
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError('Future not done after {0}s'.format(timeout))
+        return self._exc_info[1] if self._exc_info is not None else None
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def run(self, func, *args, **kw):
+        try:
+            self.set_result(func(*args, **kw))
+        except Exception:
+            self.set_exc_info(sys.exc_info())
+
+
+class WorkerPool(object):
+    """
+    Fixed number of daemon threads draining one queue of calls. The
+    number of threads bounds how many calls are in flight at once.
+    """
+
+    def __init__(self, size=10):
+        if size < 1:
+            raise ValueError('WorkerPool size must be at least 1')
+        self.size = size
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.size:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            future, func, args, kw = task
+            future.run(func, *args, **kw)
+
+    def submit(self, func, *args, **kw):
+        if len(self._threads) < self.size:
+            self._start()
+        future = Future()
+        self._queue.put((future, func, args, kw))
+        return future
+
+    def imap_unordered(self, func, items):
+        """
+        Call `func(item)` for every item and yield `(item, future)` pairs
+        in completion order. An item is submitted when an earlier one is
+        done, at most `size` at a time, so closing the generator stops the
+        calls not started yet.
+        """
+        done = Queue.Queue()
+        items = iter(items)
+
+        def submit_next():
+            for item in items:
+                future = self.submit(func, item)
+                future.add_done_callback(
+                    lambda f, item=item: done.put((item, f))
+                )
+                return 1
+            return 0
+
+        pending = sum(submit_next() for _ in xrange(self.size))
+        while pending:
+            outcome = done.get()
+            pending += submit_next() - 1
+            yield outcome
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+
+def as_completed(futures):
+    done = Queue.Queue()
+    futures = list(futures)
+    for future in futures:
+        future.add_done_callback(done.put)
+    for _ in futures:
+        yield done.get()
+
+
+def gather(futures, return_exceptions=False):
+    """
+    Wait for all futures and return their results in order. With
+    `return_exceptions` the exceptions take the place of failed results
+    instead of being raised.
+    """
+    results = []
+    for future in futures:
+        if return_exceptions:
+            error = future.exception()
+            results.append(error if error is not None else future.result())
+        else:
+            results.append(future.result())
+    return results
+
+
+def map_bounded(func, items, concurrency):
+    """
+    Return `[func(item) for item in items]` computed with at most
+    `concurrency` calls in flight. The first failure is raised.
+    """
+    items = list(items)
+    if concurrency <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    pool = WorkerPool(min(concurrency, len(items)))
+    try:
+        return gather([pool.submit(func, item) for item in items])
+    finally:
+        pool.shutdown()
+
+
+def deferred(name):
+    """
+    Expose method `name` as a call submitted to the client's worker pool.
+    For classmethods the client is the first positional argument, for
+    instance methods it is the object's own client. The client must be
+    an AsyncClient.
+    """
+    class Deferred(object):
+        def __get__(self, instance, owner):
+            target = getattr(owner if instance is None else instance, name)
+
+            def submit(*args, **kw):
+                client = args[0] if instance is None else instance._client
+                return client.submit(target, *args, **kw)
+            submit.__name__ = '{0}_async'.format(name)
+            return submit
+    return Deferred()
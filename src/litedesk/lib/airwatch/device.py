@@ -12,31 +12,84 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from base import BaseObject
+from base import BaseObject, DEFAULT_PAGE_SIZE, PackedId, get_items
 from app import App
+from concurrency import deferred, map_bounded
 
 
 class Device(BaseObject):
+    FIELDS = (
+        'Id', 'Udid', 'SerialNumber', 'MacAddress', 'UserName', 'Platform',
+        'Model', 'OperatingSystem', 'Ownership', 'LastSeen'
+    )
+    __slots__ = ('_id', '_installed_apps', '_installed_app_ids') + FIELDS[1:]
+
+    Id = PackedId()
+
+    def __init__(self, client, *args, **kw):
+        self._installed_apps = None
+        self._installed_app_ids = None
+        super(Device, self).__init__(client, *args, **kw)
 
     @classmethod
     def search(cls, client, **kwargs):
-        endpoint = 'mdm/devices/search'
-        response = client.call_api('GET', endpoint, params=kwargs)
-        response.raise_for_status()
-        try:
-            return [
-                cls(client, **attrs)
-                for attrs in response.json().get('Devices')
-            ]
-        except:
-            return []
+        items, total = get_items(client, 'mdm/devices/search', 'Devices', kwargs)
+        return [cls(client, **attrs) for attrs in items]
+
+    @classmethod
+    def iter_search(cls, client, pagesize=DEFAULT_PAGE_SIZE, prefetch=False, **kwargs):
+        return cls._iter_search(
+            client, 'mdm/devices/search', 'Devices', kwargs, pagesize, prefetch
+        )
 
     @property
     def installed_apps(self):
+        """
+        Apps installed on the device, fetched on first access and kept
+        until `refresh()`.
+        """
+        if self._installed_apps is None:
+            self.refresh()
+        return self._installed_apps
+
+    @property
+    def installed_app_ids(self):
+        if self._installed_app_ids is None:
+            self.refresh()
+        return self._installed_app_ids
+
+    def refresh(self):
         endpoint = 'mdm/devices/udid/{0}/apps'.format(self.Udid)
         response = self._client.call_api('GET', endpoint)
         response.raise_for_status()
-        return [
+        apps = [
             App(self._client, **attrs)
             for attrs in response.json().get('DeviceApps')
         ]
+        self._installed_app_ids = frozenset(app.Id['Value'] for app in apps)
+        self._installed_apps = apps
+        return apps
+
+    def _add_installed_app(self, app):
+        # keep a fetched inventory in step with an install sent through it
+        if self._installed_app_ids is None:
+            return
+        if app.Id['Value'] not in self._installed_app_ids:
+            self._installed_app_ids = self._installed_app_ids | set([app.Id['Value']])
+            self._installed_apps = self._installed_apps + [app]
+
+    @classmethod
+    def fetch_inventories(cls, devices, concurrency=8):
+        """
+        Load the installed apps of many devices, `concurrency` at a time.
+        Returns the devices.
+        """
+        devices = list(devices)
+        map_bounded(lambda device: device.refresh(), devices, concurrency)
+        return devices
+
+    def get_installed_apps(self):
+        return self.installed_apps
+
+    search_async = deferred('search')
+    get_installed_apps_async = deferred('get_installed_apps')
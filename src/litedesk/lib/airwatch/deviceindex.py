@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import threading
+from array import array
+
+from base import DEFAULT_PAGE_SIZE
+from device import Device
+
+
+class _Category(object):
+    """
+    Column of a field with few distinct values: each value is stored once,
+    rows hold its code, and the rows of every value are indexed.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+        self.rows = array('i')
+        self.index = {}
+
+    def _code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def append(self, value):
+        code = self._code(value)
+        self.index.setdefault(code, set()).add(len(self.rows))
+        self.rows.append(code)
+
+    def set(self, row, value):
+        old, code = self.rows[row], self._code(value)
+        if old != code:
+            self.index[old].discard(row)
+            self.index.setdefault(code, set()).add(row)
+            self.rows[row] = code
+
+    def get(self, row):
+        return self.values[self.rows[row]]
+
+    def lookup(self, value):
+        code = self.codes.get(value)
+        return self.index.get(code, set()) if code is not None else set()
+
+
+class _Store(object):
+    def __init__(self):
+        self.ids = []
+        self.row_of = {}
+        self.plain = dict((field, []) for field in DeviceIndex.PLAIN)
+        self.categories = dict(
+            (field, _Category()) for _, field in DeviceIndex.CATEGORIES
+        )
+        self.last_seen = []
+        # rows ordered by LastSeen, kept as two parallel lists for bisect
+        self.seen_keys = []
+        self.seen_rows = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _unsee(self, row):
+        key = self.last_seen[row]
+        position = bisect.bisect_left(self.seen_keys, key)
+        while self.seen_rows[position] != row:
+            position += 1
+        del self.seen_keys[position]
+        del self.seen_rows[position]
+
+    def _see(self, row, key):
+        position = bisect.bisect_right(self.seen_keys, key)
+        self.seen_keys.insert(position, key)
+        self.seen_rows.insert(position, row)
+
+    def upsert(self, attrs):
+        device_id = (attrs.get('Id') or {}).get('Value')
+        last_seen = attrs.get('LastSeen') or ''
+        row = self.row_of.get(device_id)
+        if row is None:
+            row = self.row_of[device_id] = len(self.ids)
+            self.ids.append(device_id)
+            for field, column in self.plain.items():
+                column.append(attrs.get(field))
+            for field, category in self.categories.items():
+                category.append(attrs.get(field))
+            self.last_seen.append(last_seen)
+        else:
+            for field, column in self.plain.items():
+                column[row] = attrs.get(field)
+            for field, category in self.categories.items():
+                category.set(row, attrs.get(field))
+            self._unsee(row)
+            self.last_seen[row] = last_seen
+        self._see(row, last_seen)
+
+    def seen_between(self, since=None, before=None):
+        start = bisect.bisect_left(self.seen_keys, since) if since else 0
+        end = (
+            bisect.bisect_left(self.seen_keys, before)
+            if before else len(self.seen_keys)
+        )
+        return set(self.seen_rows[start:end])
+
+    def attrs(self, row):
+        attrs = {'Id': {'Value': self.ids[row]}, 'LastSeen': self.last_seen[row]}
+        for field, column in self.plain.items():
+            attrs[field] = column[row]
+        for field, category in self.categories.items():
+            attrs[field] = category.get(row)
+        return dict((k, v) for k, v in attrs.items() if v is not None)
+
+
+class DeviceIndex(object):
+    """
+    The device fleet loaded with one paged listing into columns, with
+    indexes on enrollment user, platform, model, OS, ownership and
+    LastSeen. `search` answers the filters of `Device.search` without a
+    request; `refresh` fetches only the devices seen since the latest
+    LastSeen already known. Load errors are raised, the index keeps what
+    it had before.
+    """
+
+    # search keyword, device field
+    CATEGORIES = (
+        ('user', 'UserName'), ('platform', 'Platform'), ('model', 'Model'),
+        ('os', 'OperatingSystem'), ('ownership', 'Ownership'),
+    )
+    PLAIN = ('Udid', 'SerialNumber', 'MacAddress')
+
+    def __init__(self, client, pagesize=DEFAULT_PAGE_SIZE):
+        self._client = client
+        self.pagesize = pagesize
+        self._store = _Store()
+        self._lock = threading.RLock()
+        self.load()
+
+    def __len__(self):
+        return len(self._store)
+
+    def load(self):
+        """Replace the index with a full walk of the fleet."""
+        store = _Store()
+        for device in Device.iter_search(self._client, pagesize=self.pagesize):
+            store.upsert(device.fields())
+        with self._lock:
+            self._store = store
+
+    def refresh(self):
+        """
+        Fetch the devices seen since the latest LastSeen in the index and
+        update them in place. Returns how many were fetched. Devices
+        removed from the tenant are only dropped by `load`.
+        """
+        with self._lock:
+            since = self._store.seen_keys[-1] if self._store.seen_keys else None
+        if since is None:
+            self.load()
+            return len(self)
+        devices = list(Device.iter_search(
+            self._client, pagesize=self.pagesize, seensince=since
+        ))
+        with self._lock:
+            for device in devices:
+                self._store.upsert(device.fields())
+        return len(devices)
+
+    def _rows(self, filters):
+        store = self._store
+        unknown = set(filters) - set(
+            ['seensince', 'seenbefore'] + [name for name, _ in self.CATEGORIES]
+        )
+        if unknown:
+            raise TypeError('Unknown device filters: {0}'.format(
+                ', '.join(sorted(unknown))
+            ))
+        matches = [
+            store.categories[field].lookup(filters[name])
+            for name, field in self.CATEGORIES if name in filters
+        ]
+        if 'seensince' in filters or 'seenbefore' in filters:
+            matches.append(store.seen_between(
+                filters.get('seensince'), filters.get('seenbefore')
+            ))
+        if not matches:
+            return range(len(store))
+        matches.sort(key=len)
+        rows = set(matches[0])
+        for other in matches[1:]:
+            rows &= other
+            if not rows:
+                break
+        return sorted(rows)
+
+    def count(self, **filters):
+        with self._lock:
+            return len(self._rows(filters))
+
+    def search(self, **filters):
+        """
+        Devices matching every filter among user, platform, model, os,
+        ownership, seensince and seenbefore (LastSeen strings).
+        """
+        with self._lock:
+            store = self._store
+            attrs = [store.attrs(row) for row in self._rows(filters)]
+        return [Device(self._client, **a) for a in attrs]
+
+    def get(self, device_id):
+        with self._lock:
+            row = self._store.row_of.get(device_id)
+            if row is None:
+                return None
+            return Device(self._client, **self._store.attrs(row))
+
+    def values(self, field):
+        """Distinct values of an indexed field, e.g. `values('Platform')`."""
+        with self._lock:
+            category = self._store.categories[field]
+            return [
+                value for code, value in enumerate(category.values)
+                if category.index.get(code)
+            ]
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+from base import DEFAULT_PAGE_SIZE
+from user import User
+
+
+class UserDirectory(object):
+    """
+    Every user of the tenant, loaded with one paged listing and indexed by
+    username, Id and (case insensitive) email. Set as
+    `client.user_directory` it answers `User.get_remote` and
+    `User.get_many` without any request, and `create`, `delete`,
+    `activate` and `deactivate` keep it up to date.
+    """
+
+    def __init__(self, client, pagesize=DEFAULT_PAGE_SIZE):
+        self._client = client
+        self.pagesize = pagesize
+        self._by_username = {}
+        self._by_id = {}
+        self._by_email = {}
+        self._lock = threading.RLock()
+        self.refresh()
+
+    def __len__(self):
+        return len(self._by_username)
+
+    def __iter__(self):
+        return iter(self._by_username.values())
+
+    def __contains__(self, username):
+        return username in self._by_username
+
+    def get(self, username):
+        return self._by_username.get(username)
+
+    def get_by_id(self, user_id):
+        return self._by_id.get(user_id)
+
+    def get_by_email(self, email):
+        return self._by_email.get(email.lower()) if email else None
+
+    def put(self, user):
+        with self._lock:
+            self._discard(user.UserName)
+            self._by_username[user.UserName] = user
+            if user.id is not None:
+                self._by_id[user.id] = user
+            email = getattr(user, 'Email', None)
+            if email:
+                self._by_email[email.lower()] = user
+
+    def discard(self, username):
+        with self._lock:
+            self._discard(username)
+
+    def _discard(self, username):
+        user = self._by_username.pop(username, None)
+        if user is None:
+            return
+        if self._by_id.get(user.id) is user:
+            del self._by_id[user.id]
+        email = (getattr(user, 'Email', None) or '').lower()
+        if self._by_email.get(email) is user:
+            del self._by_email[email]
+
+    def refresh(self):
+        """
+        Walk the user listing again and apply the difference in place.
+        Returns the usernames `(added, changed, removed)`.
+        """
+        added, changed, seen = [], [], set()
+        for user in User.iter_search(self._client, pagesize=self.pagesize):
+            seen.add(user.UserName)
+            with self._lock:
+                known = self._by_username.get(user.UserName)
+                if known is None:
+                    added.append(user.UserName)
+                elif known.fields() != user.fields():
+                    changed.append(user.UserName)
+                else:
+                    continue
+                self.put(user)
+        with self._lock:
+            removed = [name for name in self._by_username if name not in seen]
+            for username in removed:
+                self._discard(username)
+        return added, changed, removed
+
+    def refresh_user(self, username):
+        """Fetch one user again, returning it or None once it is gone."""
+        user = User.get_remote(self._client, username, max_age=0)
+        if user is None:
+            self.discard(username)
+        else:
+            self.put(user)
+        return user
@@ -0,0 +1,567 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-process fake of the AirWatch REST API, covering the endpoints used by
+this library. It keeps tenant state in memory and can add latency, random
+server errors and 429 throttling, so that workflows can be measured and
+tested without a live tenant.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import json
+import random
+import re
+import threading
+import time
+import urlparse
+from collections import defaultdict
+
+from metrics import endpoint_template
+
+
+class FakeAirWatch(object):
+
+    DEFAULT_PAGE_SIZE = 500
+
+    def __init__(self, latency=0.0, error_rate=0.0, throttle_rate=0.0,
+                 max_rps=None, retry_after=1, smart_group_create_quirk=False,
+                 seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_rps = max_rps
+        self.retry_after = retry_after
+        # AirWatch answers 400 to some smart group creations that succeed
+        self.smart_group_create_quirk = smart_group_create_quirk
+        self.random = random.Random(seed)
+        self.users = {}
+        self.user_groups = {}
+        self.smart_groups = {}
+        self.apps = {}
+        self.devices = {}
+        self.request_count = 0
+        self.requests = defaultdict(int)
+        self._ids = iter(xrange(1000, 10 ** 9))
+        self._lock = threading.RLock()
+        self._window = (0, 0)
+        self._routes = [
+            ('GET', r'system/users/search', self._users_search),
+            ('POST', r'system/users/adduser', self._users_add),
+            ('POST', r'system/users/(\d+)/activate', self._users_activate),
+            ('POST', r'system/users/(\d+)/deactivate', self._users_deactivate),
+            ('DELETE', r'system/users/(\d+)/delete', self._users_delete),
+            ('GET', r'system/usergroups/custom/search', self._user_groups_search),
+            ('GET', r'system/usergroups/(\d+)/users', self._user_groups_users),
+            ('POST', r'system/usergroups/(\d+)/user/(\d+)/addusertogroup', self._user_groups_add),
+            ('POST', r'system/usergroups/(\d+)/user/(\d+)/removeuserfromgroup', self._user_groups_remove),
+            ('POST', r'mdm/smartgroups/create', self._smart_groups_create),
+            ('GET', r'mdm/smartgroups/search', self._smart_groups_search),
+            ('GET', r'mdm/smartgroups/(\d+)', self._smart_groups_get),
+            ('POST', r'mdm/smartgroups/(\d+)/update', self._smart_groups_update),
+            ('DELETE', r'mdm/smartgroups/(\d+)/delete', self._smart_groups_delete),
+            ('GET', r'mam/apps/search', self._apps_search),
+            ('GET', r'mam/apps/public/(\d+)', self._apps_get),
+            ('POST', r'mam/apps/public/(\d+)/install', self._apps_install),
+            ('POST', r'mam/apps/public/(\d+)/addsmartgroup/(\d+)', self._apps_add_smart_group),
+            ('POST', r'mam/apps/public/(\d+)/deletesmartgroup/(\d+)', self._apps_delete_smart_group),
+            ('GET', r'mdm/devices/search', self._devices_search),
+            ('GET', r'mdm/devices/udid/([^/]+)/apps', self._devices_apps),
+        ]
+        self._routes = [
+            (method, re.compile('^{0}$'.format(pattern)), handler)
+            for method, pattern, handler in self._routes
+        ]
+
+    # seeding
+
+    def _next_id(self):
+        return next(self._ids)
+
+    def add_user(self, username, active=False, **attrs):
+        with self._lock:
+            user_id = self._next_id()
+            user = {
+                'Id': {'Value': user_id},
+                'UserName': username,
+                'Email': '{0}@example.com'.format(username),
+                'SecurityType': 'Directory',
+                'Status': active,
+            }
+            user.update(attrs)
+            self.users[user_id] = user
+            return user
+
+    def add_user_group(self, name, members=()):
+        with self._lock:
+            group_id = self._next_id()
+            self.user_groups[group_id] = {
+                'UserGroupId': group_id,
+                'UserGroupName': name,
+                'members': set(members),
+            }
+            return self.user_groups[group_id]
+
+    def add_smart_group(self, name, user_groups=(), user_additions=()):
+        with self._lock:
+            smart_group_id = self._next_id()
+            self.smart_groups[smart_group_id] = self._smart_group(
+                smart_group_id, {
+                    'Name': name,
+                    'UserGroups': [
+                        {'Id': g['UserGroupId'], 'Name': g['UserGroupName']}
+                        for g in user_groups
+                    ],
+                    'UserAdditions': [
+                        {'Id': str(u['Id']['Value']), 'Name': u['UserName']}
+                        for u in user_additions
+                    ],
+                }
+            )
+            return self.smart_groups[smart_group_id]
+
+    def add_app(self, name, smart_groups=()):
+        with self._lock:
+            app_id = self._next_id()
+            self.apps[app_id] = {
+                'Id': {'Value': app_id},
+                'ApplicationName': name,
+                'BundleId': 'com.example.{0}'.format(app_id),
+                'SmartGroups': [
+                    {'Id': sg['SmartGroupID'], 'Name': sg['Name']}
+                    for sg in smart_groups
+                ],
+            }
+            return self.apps[app_id]
+
+    def add_device(self, username, platform='Apple', model='iPhone',
+                   operating_system='7.1', ownership='C', apps=(),
+                   last_seen=None):
+        with self._lock:
+            device_id = self._next_id()
+            udid = '{0:040x}'.format(device_id)
+            self.devices[device_id] = {
+                'Id': {'Value': device_id},
+                'Udid': udid,
+                'SerialNumber': 'SN{0}'.format(device_id),
+                'MacAddress': '{0:012x}'.format(device_id),
+                'UserName': username,
+                'Platform': platform,
+                'Model': model,
+                'OperatingSystem': operating_system,
+                'Ownership': ownership,
+                'LastSeen': last_seen or time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'installed': set(app['Id']['Value'] for app in apps),
+            }
+            return self.devices[device_id]
+
+    def populate(self, users=0, user_groups=0, smart_groups=0, apps=0,
+                 devices=0):
+        """Fill the tenant with generated objects."""
+        user_list = [self.add_user('user{0}'.format(i)) for i in xrange(users)]
+        group_list = [
+            self.add_user_group('group{0}'.format(i)) for i in xrange(user_groups)
+        ]
+        smart_group_list = [
+            self.add_smart_group(
+                'smartgroup{0}'.format(i),
+                user_groups=[group_list[i % len(group_list)]] if group_list else ()
+            )
+            for i in xrange(smart_groups)
+        ]
+        app_list = [
+            self.add_app(
+                'app{0}'.format(i),
+                smart_groups=[smart_group_list[i % len(smart_group_list)]]
+                if smart_group_list else ()
+            )
+            for i in xrange(apps)
+        ]
+        for i in xrange(devices):
+            self.add_device(
+                user_list[i % len(user_list)]['UserName'] if user_list else 'nobody',
+                platform=('Apple', 'Android', 'WindowsPhone')[i % 3],
+                model=('iPhone', 'iPad', 'Galaxy S5', 'Lumia')[i % 4],
+                operating_system=('7.1', '8.0', '4.4')[i % 3],
+                ownership=('C', 'E')[i % 2],
+                apps=app_list[i % 3:i % 3 + 2] if app_list else ()
+            )
+
+    def reset_counters(self):
+        with self._lock:
+            self.request_count = 0
+            self.requests.clear()
+
+    # request dispatch
+
+    def _throttled(self):
+        if self.throttle_rate and self.random.random() < self.throttle_rate:
+            return True
+        if self.max_rps is None:
+            return False
+        second = int(time.time())
+        window, count = self._window
+        if window != second:
+            window, count = second, 0
+        self._window = (window, count + 1)
+        return count >= self.max_rps
+
+    def handle(self, method, path, query, body):
+        """Return `(status, payload, headers)` for one request."""
+        if self.latency:
+            time.sleep(self.latency)
+        endpoint = path.split('/API/v1/', 1)[-1].strip('/')
+        with self._lock:
+            self.request_count += 1
+            self.requests['{0} {1}'.format(method, endpoint_template(endpoint))] += 1
+            if self._throttled():
+                return 429, {'Message': 'Too many requests'}, {
+                    'Retry-After': str(self.retry_after)
+                }
+            if self.error_rate and self.random.random() < self.error_rate:
+                return 500, {'Message': 'Internal server error'}, {}
+            for route_method, pattern, handler in self._routes:
+                match = pattern.match(endpoint)
+                if match and route_method == method:
+                    return handler(query, body, *match.groups())
+        return 404, {'Message': 'Not found'}, {}
+
+    @staticmethod
+    def _page(items, query, key):
+        page = int(query.get('page', 0))
+        pagesize = int(query.get('pagesize', FakeAirWatch.DEFAULT_PAGE_SIZE))
+        return {
+            key: items[page * pagesize:(page + 1) * pagesize],
+            'Page': page,
+            'PageSize': pagesize,
+            'Total': len(items),
+        }
+
+    @staticmethod
+    def _error(message, status=400):
+        return status, {'Message': message}, {}
+
+    @staticmethod
+    def _sorted(objects):
+        return [objects[k] for k in sorted(objects)]
+
+    # users
+
+    def _users_search(self, query, body):
+        username = query.get('username', '').lower()
+        users = [
+            u for u in self._sorted(self.users)
+            if username in u['UserName'].lower()
+        ]
+        if not users:
+            return 204, None, {}
+        return 200, self._page(users, query, 'Users'), {}
+
+    def _users_add(self, query, body):
+        username = body.get('username')
+        if any(u['UserName'] == username for u in self.users.values()):
+            return self._error('User already exists.')
+        user = self.add_user(username)
+        return 200, {'Value': user['Id']['Value']}, {}
+
+    def _get_user(self, user_id):
+        return self.users.get(int(user_id))
+
+    def _users_activate(self, query, body, user_id):
+        user = self._get_user(user_id)
+        if user is None:
+            return self._error('User not found.', 404)
+        if user['Status']:
+            return self._error('User is already active.')
+        user['Status'] = True
+        return 200, None, {}
+
+    def _users_deactivate(self, query, body, user_id):
+        user = self._get_user(user_id)
+        if user is None:
+            return self._error('User not found.', 404)
+        if not user['Status']:
+            return self._error('User is already inactive.')
+        user['Status'] = False
+        return 200, None, {}
+
+    def _users_delete(self, query, body, user_id):
+        if self.users.pop(int(user_id), None) is None:
+            return self._error('User not found.', 404)
+        for group in self.user_groups.values():
+            group['members'].discard(int(user_id))
+        return 200, None, {}
+
+    # user groups
+
+    @staticmethod
+    def _user_group_attrs(group):
+        return dict((k, v) for k, v in group.items() if k != 'members')
+
+    def _user_groups_search(self, query, body):
+        name = query.get('groupname')
+        groups = [
+            self._user_group_attrs(g) for g in self._sorted(self.user_groups)
+            if name is None or g['UserGroupName'] == name
+        ]
+        return 200, {'UserGroup': groups}, {}
+
+    def _user_groups_users(self, query, body, group_id):
+        group = self.user_groups.get(int(group_id))
+        if group is None:
+            return self._error('User group not found.', 404)
+        users = [
+            {'Id': {'Value': user_id}, 'UserName': self.users[user_id]['UserName']}
+            for user_id in sorted(group['members']) if user_id in self.users
+        ]
+        if not users:
+            return 204, None, {}
+        return 200, {'EnrollmentUser': users}, {}
+
+    def _user_groups_add(self, query, body, group_id, user_id):
+        group = self.user_groups.get(int(group_id))
+        if group is None or self._get_user(user_id) is None:
+            return self._error('Not found.', 404)
+        if int(user_id) in group['members']:
+            return self._error('Enrollment User is already assigned to the User Group.')
+        group['members'].add(int(user_id))
+        return 200, None, {}
+
+    def _user_groups_remove(self, query, body, group_id, user_id):
+        group = self.user_groups.get(int(group_id))
+        if group is None:
+            return self._error('Not found.', 404)
+        if int(user_id) not in group['members']:
+            return self._error('Enrollment User is not assigned to the User Group.')
+        group['members'].discard(int(user_id))
+        return 200, None, {}
+
+    # smart groups
+
+    @staticmethod
+    def _smart_group(smart_group_id, attrs):
+        smart_group = {
+            'SmartGroupID': smart_group_id,
+            'Name': '',
+            'CriteriaType': 'All',
+            'ManagedByOrganizationGroupId': '1',
+            'OrganizationGroups': [],
+            'UserGroups': [],
+            'Tags': [],
+            'Ownerships': [],
+            'Platforms': [],
+            'Models': [],
+            'OperatingSystems': [],
+            'UserAdditions': [],
+            'UserExclusions': [],
+            'DeviceAdditions': [],
+            'DeviceExclusions': [],
+        }
+        smart_group.update(attrs)
+        smart_group['SmartGroupID'] = smart_group_id
+        return smart_group
+
+    def _smart_groups_create(self, query, body):
+        smart_group_id = self._next_id()
+        self.smart_groups[smart_group_id] = self._smart_group(smart_group_id, body)
+        if self.smart_group_create_quirk:
+            return self._error('Smart group could not be created.')
+        return 200, str(smart_group_id), {}
+
+    def _smart_groups_search(self, query, body):
+        name = query.get('name')
+        summaries = [
+            {
+                'SmartGroupID': sg['SmartGroupID'],
+                'Name': sg['Name'],
+                'ManagedByOrganizationGroupId': sg['ManagedByOrganizationGroupId'],
+            }
+            for sg in self._sorted(self.smart_groups)
+            if name is None or sg['Name'] == name
+        ]
+        return 200, self._page(summaries, query, 'SmartGroups'), {}
+
+    def _smart_groups_get(self, query, body, smart_group_id):
+        smart_group = self.smart_groups.get(int(smart_group_id))
+        if smart_group is None:
+            return self._error('Smart group not found.', 404)
+        return 200, smart_group, {}
+
+    def _smart_groups_update(self, query, body, smart_group_id):
+        smart_group = self.smart_groups.get(int(smart_group_id))
+        if smart_group is None:
+            return self._error('Smart group not found.', 404)
+        smart_group.update(body)
+        smart_group['SmartGroupID'] = int(smart_group_id)
+        return 200, None, {}
+
+    def _smart_groups_delete(self, query, body, smart_group_id):
+        if self.smart_groups.pop(int(smart_group_id), None) is None:
+            return self._error('Smart group not found.', 404)
+        return 200, None, {}
+
+    # apps
+
+    def _apps_search(self, query, body):
+        return 200, self._page(self._sorted(self.apps), query, 'Application'), {}
+
+    def _apps_get(self, query, body, app_id):
+        app = self.apps.get(int(app_id))
+        if app is None:
+            return self._error('Application not found.', 404)
+        return 200, app, {}
+
+    def _apps_install(self, query, body, app_id):
+        device = self.devices.get(int(query.get('DeviceId', 0)))
+        if device is None or int(app_id) not in self.apps:
+            return self._error('Not found.', 404)
+        device['installed'].add(int(app_id))
+        return 200, None, {}
+
+    def _apps_add_smart_group(self, query, body, app_id, smart_group_id):
+        app = self.apps.get(int(app_id))
+        smart_group = self.smart_groups.get(int(smart_group_id))
+        if app is None or smart_group is None:
+            return self._error('Not found.', 404)
+        if all(sg['Id'] != smart_group['SmartGroupID'] for sg in app['SmartGroups']):
+            app['SmartGroups'].append(
+                {'Id': smart_group['SmartGroupID'], 'Name': smart_group['Name']}
+            )
+        return 200, None, {}
+
+    def _apps_delete_smart_group(self, query, body, app_id, smart_group_id):
+        app = self.apps.get(int(app_id))
+        if app is None:
+            return self._error('Not found.', 404)
+        app['SmartGroups'] = [
+            sg for sg in app['SmartGroups'] if sg['Id'] != int(smart_group_id)
+        ]
+        return 200, None, {}
+
+    # devices
+
+    @staticmethod
+    def _device_attrs(device):
+        return dict((k, v) for k, v in device.items() if k != 'installed')
+
+    def _devices_search(self, query, body):
+        filters = [
+            ('user', 'UserName'), ('platform', 'Platform'),
+            ('model', 'Model'), ('ownership', 'Ownership'),
+        ]
+        devices = [
+            self._device_attrs(d) for d in self._sorted(self.devices)
+            if all(
+                query.get(param) in (None, d[field]) for param, field in filters
+            ) and d['LastSeen'] >= query.get('seensince', '')
+        ]
+        if not devices:
+            return 204, None, {}
+        return 200, self._page(devices, query, 'Devices'), {}
+
+    def _devices_apps(self, query, body, udid):
+        devices = [d for d in self.devices.values() if d['Udid'] == udid]
+        if not devices:
+            return self._error('Device not found.', 404)
+        return 200, {
+            'DeviceApps': [
+                {
+                    'Id': {'Value': app_id},
+                    'ApplicationName': self.apps[app_id]['ApplicationName'],
+                    'BundleId': self.apps[app_id]['BundleId'],
+                }
+                for app_id in sorted(devices[0]['installed']) if app_id in self.apps
+            ]
+        }, {}
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # one buffered write per response, avoids Nagle/delayed-ACK stalls
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def _dispatch(self):
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        length = int(self.headers.getheader('Content-Length') or 0)
+        raw_body = self.rfile.read(length) if length else ''
+        try:
+            body = json.loads(raw_body) if raw_body else {}
+        except ValueError:
+            body = {}
+        status, payload, headers = self.server.fake.handle(
+            self.command, url.path, query, body
+        )
+        if payload is None:
+            content = ''
+        elif isinstance(payload, basestring):
+            content = payload
+        else:
+            content = json.dumps(payload)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class FakeAirWatchServer(object):
+    """
+    Serves a FakeAirWatch over HTTP on localhost from a background thread.
+    Use as a context manager or call `start()` and `stop()`; `url` is the
+    server_url to hand to a Client.
+    """
+
+    def __init__(self, fake=None, host='127.0.0.1', port=0):
+        self.fake = fake if fake is not None else FakeAirWatch()
+        self._server = _ThreadingHTTPServer((host, port), _RequestHandler)
+        self._server.fake = self.fake
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self._server.server_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
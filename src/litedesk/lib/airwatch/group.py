@@ -14,48 +14,146 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import logging
+import sys
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
 from requests.exceptions import HTTPError
 
-from base import BaseObject
-from user import User
-from app import App
+from base import BaseObject, DEFAULT_PAGE_SIZE, get_items, iter_pages
+from user import User, UserAlreadyEnrolledError, UserNotEnrolledError
+from app import App, AppCatalogIndex
+from concurrency import WorkerPool, deferred, map_bounded
+
+
+log = logging.getLogger(__name__)
+
+
+class SyncReport(object):
+    """
+    Changes made (or, with `dry_run`, planned) by `sync_members`. `unknown`
+    lists desired usernames without an AirWatch user, `errors` maps
+    usernames to the exception their change failed with.
+    """
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.added = []
+        self.removed = []
+        self.unchanged = []
+        self.unknown = []
+        self.errors = {}
+
+    @property
+    def changed(self):
+        return bool(self.added or self.removed)
+
+    def __repr__(self):
+        return '<SyncReport{0} +{1} -{2} ={3} unknown={4} errors={5}>'.format(
+            ' (dry run)' if self.dry_run else '', len(self.added),
+            len(self.removed), len(self.unchanged), len(self.unknown),
+            len(self.errors)
+        )
 
 
 class UserGroup(BaseObject):
+    FIELDS = ('UserGroupId', 'UserGroupName')
+    __slots__ = ('_usernames', ) + FIELDS
+
+    def __init__(self, client, *args, **kw):
+        self._usernames = None
+        super(UserGroup, self).__init__(client, *args, **kw)
 
     @staticmethod
-    def usernames_by_group_id(client, group_id):
+    def members_by_group_id(client, group_id):
+        """Map of username to user id of the group members."""
         endpoint = 'system/usergroups/{0}/users'.format(group_id)
-        response = client.call_api('GET', endpoint)
-        response.raise_for_status()
         try:
-            json = response.json()
-        except:
-            return []
-        return [
-            u.get('UserName') for u in json.get('EnrollmentUser')
-        ]
+            users, total = get_items(client, endpoint, 'EnrollmentUser')
+            return dict(
+                (u.get('UserName'), (u.get('Id') or {}).get('Value'))
+                for u in users
+            )
+        except ValueError:
+            return {}
+
+    @staticmethod
+    def usernames_by_group_id(client, group_id):
+        return UserGroup.members_by_group_id(client, group_id).keys()
 
     @classmethod
-    def get_remote(cls, client, group_name):
+    def search(cls, client, **kwargs):
         endpoint = 'system/usergroups/custom/search'
-        params = {'groupname': group_name}
-        response = client.call_api('GET', endpoint, params=params)
+        response = client.call_api('GET', endpoint, params=kwargs)
         response.raise_for_status()
-        return cls(client, **response.json().get('UserGroup')[0])
+        return [cls(client, **attrs) for attrs in response.json().get('UserGroup')]
+
+    @classmethod
+    def get_remote(cls, client, group_name, max_age=None):
+        mirror = getattr(client, 'mirror', None)
+        if mirror is not None:
+            attrs = mirror.get('user_groups', group_name, max_age)
+            if attrs is not None:
+                return cls(client, **attrs)
+        group = cls.search(client, groupname=group_name)[0]
+        group._remember('user_groups', group_name)
+        return group
+
+    def _members_endpoint(self):
+        return 'system/usergroups/{0}/users'.format(self.UserGroupId)
+
+    def _member_usernames(self):
+        # with a client cache the member list is kept, and updated locally
+        # by add_member/remove_member, as long as the cache would keep the
+        # response itself: until its TTL runs out or the resource is
+        # invalidated by any other change
+        cache = getattr(self._client, 'cache', None)
+        endpoint = self._members_endpoint()
+        if self._usernames is not None:
+            usernames, expires, generation = self._usernames
+            if (
+                cache is not None and time.time() < expires
+                and cache.generation(endpoint) == generation
+            ):
+                return usernames
+            self._usernames = None
+        if cache is None:
+            return set(self.usernames_by_group_id(self._client, self.UserGroupId))
+        generation = cache.generation(endpoint)
+        usernames = set(self.usernames_by_group_id(self._client, self.UserGroupId))
+        self._usernames = (
+            usernames, time.time() + cache.ttl_for(endpoint), generation
+        )
+        return usernames
 
     def _membership_change_common(self, user, endpoint_suffix, if_exists):
         # if_exists says if operation is valid when user is already a member
         # checking for identity cause True and False are singletons
-        if if_exists is not (user.UserName in self.usernames_by_group_id(
-            self._client, self.UserGroupId
-        )):
+        usernames = self._member_usernames()
+        if if_exists is not (user.UserName in usernames):
             return
+        memo = self._usernames
         endpoint = 'system/usergroups/{0}/user/{1}/{2}'.format(
             self.UserGroupId, user.id, endpoint_suffix
         )
         response = self._client.call_api('POST', endpoint)
         response.raise_for_status()
+        if if_exists:
+            usernames.discard(user.UserName)
+        else:
+            usernames.add(user.UserName)
+        if memo is not None and self._usernames is memo:
+            # the call invalidated the resource once, anything more means
+            # another change happened meanwhile
+            cache_generation, generation = memo[2]
+            current = self._client.cache.generation(self._members_endpoint())
+            if current == (cache_generation, generation + 1):
+                self._usernames = (usernames, memo[1], current)
+            else:
+                self._usernames = None
 
     def add_member(self, user):
         self._membership_change_common(user, 'addusertogroup', False)
@@ -63,8 +161,81 @@ class UserGroup(BaseObject):
     def remove_member(self, user):
         self._membership_change_common(user, 'removeuserfromgroup', True)
 
+    def sync_members(self, desired_usernames, concurrency=8, dry_run=False):
+        """
+        Make the group members exactly `desired_usernames`: the current
+        members are fetched once, users to add are resolved with one user
+        listing and only the differences are applied, `concurrency` at a
+        time. With `dry_run` nothing is changed.
+        """
+        report = SyncReport(dry_run)
+        desired = set(desired_usernames)
+        current = self.members_by_group_id(self._client, self.UserGroupId)
+        report.unchanged = sorted(desired.intersection(current))
+        to_add = User.get_many(self._client, desired.difference(current))
+        report.unknown = sorted(desired.difference(current).difference(to_add))
+        to_remove = [
+            User(self._client, UserName=username, Id={'Value': user_id})
+            for username, user_id in current.items() if username not in desired
+        ]
+        changes = [(user, True) for user in to_add.values()]
+        changes.extend((user, False) for user in to_remove)
+        if dry_run:
+            report.added = sorted(to_add)
+            report.removed = sorted(user.UserName for user in to_remove)
+            return report
+
+        def apply(change):
+            user, add = change
+            try:
+                if add:
+                    user.add_to_group(self.UserGroupId)
+                else:
+                    user.remove_from_group(self.UserGroupId)
+            except (UserAlreadyEnrolledError, UserNotEnrolledError):
+                pass
+
+        if changes:
+            pool = WorkerPool(min(concurrency, len(changes)))
+            try:
+                for (user, add), future in pool.imap_unordered(apply, changes):
+                    error = future.exception()
+                    if error is not None:
+                        report.errors[user.UserName] = error
+                    elif add:
+                        report.added.append(user.UserName)
+                    else:
+                        report.removed.append(user.UserName)
+            finally:
+                pool.shutdown()
+        report.added.sort()
+        report.removed.sort()
+        self._usernames = None
+        return report
+
+    usernames_by_group_id_async = deferred('usernames_by_group_id')
+    get_remote_async = deferred('get_remote')
+    add_member_async = deferred('add_member')
+    remove_member_async = deferred('remove_member')
+
 
 class SmartGroup(BaseObject):
+    FIELDS = (
+        'SmartGroupID', 'Name', 'ManagedByOrganizationGroupId', 'UserGroups',
+        'UserAdditions', 'UserExclusions', 'DeviceAdditions',
+        'DeviceExclusions', 'Models', 'OperatingSystems', 'OrganizationGroups',
+        'Ownerships', 'Platforms'
+    )
+    __slots__ = (
+        '_hydrated', '_from_mirror', '_pending', '_pending_edits',
+        '_pending_since', '_auto_flush'
+    ) + FIELDS
+
+    def __init__(self, client, *args, **kw):
+        self._hydrated = True
+        self._from_mirror = False
+        self._pending = None
+        super(SmartGroup, self).__init__(client, *args, **kw)
 
     @classmethod
     def create(cls, client, **kwargs):
@@ -74,43 +245,128 @@ class SmartGroup(BaseObject):
         return cls.get_remote(client, response.text)
 
     @classmethod
-    def search(cls, client, **kwargs):
+    def search(cls, client, concurrency=8, lazy=False, **kwargs):
+        """
+        With `lazy` the groups are built from the search summary and load
+        their details on first access to a field outside of it. Otherwise
+        the details are fetched with `concurrency` requests in flight.
+        """
         endpoint = '/mdm/smartgroups/search'
         response = client.call_api('GET', endpoint, params=kwargs)
         response.raise_for_status()
-        return [
-            cls.get_remote(client, attrs['SmartGroupID'])
-            for attrs in response.json().get('SmartGroups')
-        ]
+        summaries = response.json().get('SmartGroups')
+        if lazy:
+            return [cls._from_summary(client, attrs) for attrs in summaries]
+        return cls.get_many(
+            client, [attrs['SmartGroupID'] for attrs in summaries], concurrency
+        )
+
+    @classmethod
+    def iter_search(cls, client, pagesize=DEFAULT_PAGE_SIZE, prefetch=False,
+                    lazy=False, **kwargs):
+        for attrs in iter_pages(
+            client, 'mdm/smartgroups/search', 'SmartGroups', kwargs,
+            pagesize, prefetch
+        ):
+            if lazy:
+                yield cls._from_summary(client, attrs)
+            else:
+                yield cls.get_remote(client, attrs['SmartGroupID'])
+
+    @classmethod
+    def get_many(cls, client, smart_group_ids, concurrency=8):
+        return map_bounded(
+            lambda smart_group_id: cls.get_remote(client, smart_group_id),
+            smart_group_ids, concurrency
+        )
+
+    @classmethod
+    def _from_summary(cls, client, attrs):
+        smart_group = cls(client, **attrs)
+        smart_group._hydrated = False
+        return smart_group
+
+    def __getattr__(self, name):
+        try:
+            return super(SmartGroup, self).__getattr__(name)
+        except AttributeError:
+            # fields missing from a search summary are loaded on demand
+            if name.startswith('_') or self._hydrated:
+                raise
+        self.hydrate()
+        return getattr(self, name)
+
+    def hydrate(self):
+        details = self.get_remote(self._client, self.SmartGroupID)
+        for name, value in details.fields().items():
+            setattr(self, name, value)
+        self._from_mirror = details._from_mirror
+        self._hydrated = True
+
+    def _ensure_current(self):
+        # a copy answered by the mirror can miss changes made since it was
+        # stored, membership edits start from the tenant's copy instead
+        if self._from_mirror:
+            current = self.get_remote(self._client, self.SmartGroupID, max_age=0)
+            for name, value in current.fields().items():
+                setattr(self, name, value)
+            self._from_mirror = False
+
+    @classmethod
+    def get_by_name(cls, client, name):
+        """
+        Smart group named `name` from a single filtered search, built
+        lazily from the search summary, or None.
+        """
+        for smart_group in cls.iter_search(client, lazy=True, name=name):
+            if smart_group.Name == name:
+                return smart_group
+        return None
 
     @classmethod
-    def get_remote(cls, client, smart_group_id):
+    def get_remote(cls, client, smart_group_id, max_age=None):
+        mirror = getattr(client, 'mirror', None)
+        if mirror is not None:
+            attrs = mirror.get('smart_groups', smart_group_id, max_age)
+            if attrs is not None:
+                smart_group = cls(client, **attrs)
+                smart_group._from_mirror = True
+                return smart_group
         endpoint = 'mdm/smartgroups/{0}'.format(smart_group_id)
         response = client.call_api('GET', endpoint)
         response.raise_for_status()
-        return cls(client, **response.json())
+        smart_group = cls(client, **response.json())
+        smart_group._remember('smart_groups', smart_group_id)
+        return smart_group
 
     def delete(self):
         endpoint = 'mdm/smartgroups/{0}/delete'.format(self.SmartGroupID)
         response = self._client.call_api('DELETE', endpoint)
         response.raise_for_status()
+        self._forget('smart_groups', self.SmartGroupID)
 
     def _update(self, **kwargs):
         endpoint = 'mdm/smartgroups/{0}/update'.format(self.SmartGroupID)
-        response = self._client.call_api('POST', endpoint, data=kwargs)
-        response.raise_for_status()
+        try:
+            response = self._client.call_api('POST', endpoint, data=kwargs)
+            response.raise_for_status()
+        finally:
+            self._forget('smart_groups', self.SmartGroupID)
 
     @property
     def members(self):
-        return [
-            User.get_remote(self._client, user['Name'])
-            for user in self.UserAdditions
-        ]
+        users = User.get_many(
+            self._client, [user['Name'] for user in self.UserAdditions]
+        )
+        return [users.get(user['Name']) for user in self.UserAdditions]
+
+    def apps_in(self, catalog):
+        return catalog.apps_for_smart_group(self.SmartGroupID)
 
     @property
     def apps(self):
         return [
-            app for app in App.search(self._client, pagesize=5000)
+            app for app in App.iter_search(self._client)
             if self.SmartGroupID in (
                 smart_group['Id'] for smart_group in app.SmartGroups
             )
@@ -125,6 +381,17 @@ class SmartGroup(BaseObject):
         return [{'Id': user[0], 'Name': user[1]} for user in user_additions_set]
 
     def __membership_change_common(self):
+        if self._pending is not None:
+            count = len(self._pending)
+            yield self._pending
+            if count != len(self._pending):
+                if not self._pending_edits:
+                    # max_age counts from the oldest edit not flushed yet
+                    self._pending_since = time.time()
+                self._pending_edits += 1
+                self.__maybe_auto_flush()
+            return
+        self._ensure_current()
         user_additions_set = self.__user_additions_to_set(self.UserAdditions)
         count = len(user_additions_set)
         yield user_additions_set
@@ -133,6 +400,47 @@ class SmartGroup(BaseObject):
             self._update(UserAdditions=user_additions)
             self.UserAdditions = user_additions
 
+    def __maybe_auto_flush(self):
+        max_edits, max_age = self._auto_flush
+        if (
+            max_edits is not None and self._pending_edits >= max_edits
+            or max_age is not None and time.time() - self._pending_since >= max_age
+        ):
+            self.flush()
+
+    @contextmanager
+    def batch(self, max_edits=None, max_age=None):
+        """
+        Keep membership edits in memory and send them with one update when
+        the outermost batch exits without an error. The pending edits are
+        also flushed once there are `max_edits` of them or the oldest is
+        `max_age` seconds old (checked on every edit).
+        """
+        outermost = self._pending is None
+        if outermost:
+            self._ensure_current()
+            self._pending = self.__user_additions_to_set(self.UserAdditions)
+            self._pending_edits = 0
+            self._pending_since = None
+            self._auto_flush = (max_edits, max_age)
+        try:
+            yield self
+            if outermost:
+                self.flush()
+        finally:
+            if outermost:
+                self._pending = None
+
+    def flush(self):
+        if self._pending is None:
+            return
+        if self._pending != self.__user_additions_to_set(self.UserAdditions):
+            user_additions = self.__user_additons_from_set(self._pending)
+            self._update(UserAdditions=user_additions)
+            self.UserAdditions = user_additions
+        self._pending_edits = 0
+        self._pending_since = None
+
     def add_member(self, user):
         for user_additions_set in self.__membership_change_common():
             user_additions_set.add((str(user.id), user.UserName))
@@ -141,6 +449,58 @@ class SmartGroup(BaseObject):
         for user_additions_set in self.__membership_change_common():
             user_additions_set.discard((str(user.id), user.UserName))
 
+    def add_members(self, users):
+        with self.batch():
+            for user in users:
+                self.add_member(user)
+
+    def remove_members(self, users):
+        with self.batch():
+            for user in users:
+                self.remove_member(user)
+
+    def sync_members(self, desired_usernames, dry_run=False):
+        """
+        Make `UserAdditions` exactly `desired_usernames` with a single
+        update call. With `dry_run` nothing is changed.
+        """
+        report = SyncReport(dry_run)
+        self._ensure_current()
+        desired = set(desired_usernames)
+        current = dict((user['Name'], user['Id']) for user in self.UserAdditions)
+        report.unchanged = sorted(desired.intersection(current))
+        to_add = User.get_many(self._client, desired.difference(current))
+        report.unknown = sorted(desired.difference(current).difference(to_add))
+        report.added = sorted(to_add)
+        report.removed = sorted(set(current).difference(desired))
+        if dry_run or not report.changed:
+            return report
+        user_additions = [
+            {'Id': user_id, 'Name': name}
+            for name, user_id in current.items() if name in desired
+        ]
+        user_additions.extend(
+            {'Id': str(user.id), 'Name': name} for name, user in to_add.items()
+        )
+        self._update(UserAdditions=user_additions)
+        self.UserAdditions = user_additions
+        return report
+
+    create_async = deferred('create')
+    search_async = deferred('search')
+    get_remote_async = deferred('get_remote')
+    delete_async = deferred('delete')
+    add_member_async = deferred('add_member')
+    remove_member_async = deferred('remove_member')
+
+
+class _ReplacementState(object):
+    # debounced replacement of the smart groups of one user group
+    def __init__(self):
+        self.scheduled = None
+        self.pass_lock = threading.Lock()
+        self.error = None
+
 
 class UserGroupHacked(UserGroup):
     """
@@ -151,11 +511,109 @@ class UserGroupHacked(UserGroup):
     instead of this class.
     """
 
+    __slots__ = ()
+
     SMART_GROUP_PREFIX = 'Hacked'
 
+    # seconds the user group to smart groups mapping is reused, each
+    # smart group is fetched again right before it is replaced
+    SMART_GROUP_CACHE_TTL = 300
+    # smart groups listed per client and user group name
+    _smart_group_cache = weakref.WeakKeyDictionary()
+    _smart_group_cache_lock = threading.Lock()
+
+    # apps of one smart group moved at the same time
+    move_concurrency = 8
+    # seconds to wait for further membership changes before replacing
+    debounce = 0
+    # shared by every instance of a user group, per client and UserGroupId,
+    # so only one replacement pass of a group runs at a time
+    _replacement_states = weakref.WeakKeyDictionary()
+    _debounce_lock = threading.Lock()
+
     def _membership_change_common(self, *args, **kw):
+        self._raise_replacement_error()
         super(UserGroupHacked, self)._membership_change_common(*args, **kw)
+        self._schedule_replacement()
+
+    def sync_members(self, *args, **kw):
+        self._raise_replacement_error()
+        report = super(UserGroupHacked, self).sync_members(*args, **kw)
+        if report.changed and not report.dry_run:
+            self._schedule_replacement()
+        return report
+
+    def _replacement_state(self):
+        with self._debounce_lock:
+            states = self._replacement_states.setdefault(self._client, {})
+            state = states.get(self.UserGroupId)
+            if state is None:
+                state = states[self.UserGroupId] = _ReplacementState()
+            return state
+
+    def _schedule_replacement(self):
+        state = self._replacement_state()
+        if not self.debounce:
+            with state.pass_lock:
+                self._replace_smart_groups()
+            return
+        with self._debounce_lock:
+            if state.scheduled is None:
+                token = object()
+                timer = threading.Timer(
+                    self.debounce, self._run_scheduled, [state, token]
+                )
+                timer.daemon = True
+                state.scheduled = (token, timer)
+                timer.start()
+
+    def _claim_scheduled(self, state, token=None):
+        # changes made from now on schedule a new pass
+        with self._debounce_lock:
+            scheduled = state.scheduled
+            if scheduled is None or token is not None and scheduled[0] is not token:
+                return None
+            state.scheduled = None
+            return scheduled
+
+    def _run_scheduled(self, state, token):
+        with state.pass_lock:
+            if self._claim_scheduled(state, token) is None:
+                return
+            try:
+                self._replace_smart_groups()
+            except Exception:
+                log.exception(
+                    'Replacing the smart groups of %s failed', self.UserGroupName
+                )
+                with self._debounce_lock:
+                    state.error = sys.exc_info()
+
+    def _raise_replacement_error(self):
+        state = self._replacement_state()
+        with self._debounce_lock:
+            exc_info, state.error = state.error, None
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def flush_replacements(self):
+        """
+        Run a pending debounced replacement pass now, wait for one running
+        in the background, and raise the error of a pass that failed there.
+        A failed background pass is also logged, and its error is raised by
+        the next membership change if nothing flushed it before.
+        """
+        state = self._replacement_state()
+        with state.pass_lock:
+            scheduled = self._claim_scheduled(state)
+            if scheduled is not None:
+                scheduled[1].cancel()
+                self._replace_smart_groups()
+        self._raise_replacement_error()
+
+    def _replace_smart_groups(self):
         smart_groups = self._smart_groups
+        catalog = None
         for smart_group in smart_groups:
             if (
                 smart_group.Name.startswith(self.SMART_GROUP_PREFIX)
@@ -164,18 +622,71 @@ class UserGroupHacked(UserGroup):
                 )
             ):
                 continue
-            self._replace_smart_group(smart_group)
+            # the listing may be old, replace the smart group as it is now
+            current = self._fetch_current(smart_group)
+            if current is None:
+                self._cache_replaced(smart_group, None)
+                continue
+            if catalog is None:
+                # the apps are moved off the smart group before it is
+                # deleted, a stale snapshot would lose new assignments
+                catalog = AppCatalogIndex(self._client, max_age=0)
+            new_smart_group = self._replace_smart_group(current, catalog)
+            self._cache_replaced(smart_group, new_smart_group)
+
+    def _fetch_current(self, smart_group):
+        try:
+            current = SmartGroup.get_remote(
+                self._client, smart_group.SmartGroupID, max_age=0
+            )
+        except HTTPError, e:
+            if e.response.status_code != 404:
+                raise
+            return None
+        if self.UserGroupName not in (
+            user_group['Name'] for user_group in current.UserGroups or ()
+        ):
+            return None
+        return current
 
     @property
     def _smart_groups(self):
-        return [
+        with self._smart_group_cache_lock:
+            cached = self._smart_group_cache.get(self._client, {}).get(self.UserGroupName)
+        if cached is not None and time.time() - cached[0] < self.SMART_GROUP_CACHE_TTL:
+            return list(cached[1])
+        smart_groups = [
             smart_group for smart_group in SmartGroup.search(self._client)
             if self.UserGroupName in (
                 user_group['Name'] for user_group in smart_group.UserGroups
             ) and smart_group.Name not in ('All', 'Staging User')
         ]
+        with self._smart_group_cache_lock:
+            self._smart_group_cache.setdefault(self._client, {})[self.UserGroupName] = (
+                time.time(), smart_groups
+            )
+        return list(smart_groups)
+
+    def _cache_replaced(self, smart_group, new_smart_group):
+        with self._smart_group_cache_lock:
+            cached = self._smart_group_cache.get(self._client, {}).get(self.UserGroupName)
+            if cached is None:
+                return
+            cached[1][:] = [
+                new_smart_group if sg.SmartGroupID == smart_group.SmartGroupID else sg
+                for sg in cached[1]
+                if new_smart_group is not None or sg.SmartGroupID != smart_group.SmartGroupID
+            ]
+
+    @classmethod
+    def clear_smart_group_cache(cls, client=None):
+        with cls._smart_group_cache_lock:
+            if client is None:
+                cls._smart_group_cache.clear()
+            else:
+                cls._smart_group_cache.pop(client, None)
 
-    def _replace_smart_group(self, smart_group):
+    def _replace_smart_group(self, smart_group, catalog=None):
         name = smart_group.Name
         temp_name = 'Hacked {0}'.format(name)
         try:
@@ -199,15 +710,20 @@ class UserGroupHacked(UserGroup):
             if e.response.status_code != 400:
                 raise
             else:
-                new_smart_group = [
-                    sg for sg in SmartGroup.search(self._client)
-                    if sg.Name == temp_name
-                ][0]
-        self._move_apps(smart_group, new_smart_group)
+                new_smart_group = SmartGroup.get_by_name(self._client, temp_name)
+                if new_smart_group is None:
+                    raise
+        self._move_apps(smart_group, new_smart_group, catalog)
         smart_group.delete()
         new_smart_group._update(Name=name)
+        new_smart_group.Name = name
+        return new_smart_group
+
+    def _move_apps(self, smart_group, new_smart_group, catalog=None):
+        if catalog is None:
+            catalog = AppCatalogIndex(self._client, max_age=0)
 
-    def _move_apps(self, smart_group, new_smart_group):
-        for app in smart_group.apps:
+        def move(app):
             app.add_smart_group(new_smart_group)
             app.delete_smart_group(smart_group)
+        map_bounded(move, smart_group.apps_in(catalog), self.move_concurrency)
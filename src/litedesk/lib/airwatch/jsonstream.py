@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Incremental parsing of `{"Key": [item, item, ...], ...}` response bodies,
+yielding the items of one top-level array while the body downloads.
+"""
+
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARS = '0123456789.eE+-'
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _Buffer(object):
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decode = codecs.getincrementaldecoder('utf-8')().decode
+        self.text = u''
+        self.pos = 0
+        self.exhausted = False
+
+    def more(self):
+        """Read the next chunk, return False at the end of the body."""
+        for chunk in self._chunks:
+            if isinstance(chunk, str):
+                chunk = self._decode(chunk)
+            if chunk:
+                # drop what was consumed so memory stays flat
+                self.text = self.text[self.pos:] + chunk
+                self.pos = 0
+                return True
+        self.exhausted = True
+        return False
+
+    def skip_whitespace(self):
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text) or not self.more():
+                return
+
+    def peek(self):
+        self.skip_whitespace()
+        if self.pos >= len(self.text):
+            raise ValueError('Unexpected end of JSON body')
+        return self.text[self.pos]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected {0!r} at {1!r}'.format(
+                char, self.text[self.pos:self.pos + 20]
+            ))
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except ValueError:
+                if not self.more():
+                    raise
+                continue
+            # a number cut short by the end of the buffer, e.g. `3.` of
+            # `3.5`, continues in the next chunk
+            truncated = (
+                isinstance(value, (int, long, float)) and not isinstance(value, bool)
+                and (end == len(self.text) or self.text[end] in _NUMBER_CHARS)
+            )
+            if not truncated or self.exhausted or not self.more():
+                self.pos = end
+                return value
+
+
+def iter_json_array(chunks, key):
+    """
+    Yield the items of the array stored under `key` in the JSON object
+    read from `chunks` (byte or unicode strings). Nothing is yielded for
+    an empty body or when the key is missing or null.
+    """
+    buf = _Buffer(chunks)
+    buf.skip_whitespace()
+    if buf.pos >= len(buf.text):
+        return
+    buf.expect('{')
+    if buf.peek() == '}':
+        return
+    while True:
+        name = buf.value()
+        buf.expect(':')
+        if name != key:
+            buf.value()
+        elif buf.peek() == 'n':
+            return
+        else:
+            buf.expect('[')
+            if buf.peek() == ']':
+                return
+            while True:
+                yield buf.value()
+                if buf.peek() == ']':
+                    return
+                buf.expect(',')
+        if buf.peek() == '}':
+            return
+        buf.expect(',')
+
+
+def iter_response_array(response, key, chunk_size=CHUNK_SIZE):
+    """
+    Yield the items under `key` of a response requested with stream=True,
+    then release its connection.
+    """
+    try:
+        for item in iter_json_array(response.iter_content(chunk_size), key):
+            yield item
+    finally:
+        response.close()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import re
+import threading
+
+
+_ID_SEGMENT = re.compile(r'^(\d+|[0-9a-fA-F-]{16,})$')
+
+
+def endpoint_template(endpoint):
+    """
+    Replace the ids in an endpoint by `{id}`, so that e.g.
+    `system/users/42/activate` becomes `system/users/{id}/activate`.
+    """
+    return '/'.join(
+        '{id}' if _ID_SEGMENT.match(segment) else segment
+        for segment in endpoint.strip('/').split('/')
+    )
+
+
+def response_size(response):
+    length = response.headers.get('Content-Length')
+    if length is not None:
+        return int(length)
+    if getattr(response, '_content_consumed', False):
+        return len(response.content or '')
+    return 0
+
+
+class Hook(object):
+    """
+    Base class of Client hooks. Subclasses override the events they need;
+    `elapsed` is the time in seconds since the call started, retries
+    included.
+    """
+
+    def before_request(self, method, endpoint, kw):
+        pass
+
+    def after_response(self, method, endpoint, response, elapsed):
+        pass
+
+    def on_retry(self, method, endpoint, attempt, delay, response, error):
+        pass
+
+    def on_error(self, method, endpoint, error, elapsed):
+        pass
+
+
+class Histogram(object):
+    # upper bounds in seconds, from 1ms doubling up to ~65s
+    BOUNDS = tuple(0.001 * pow(2, i) for i in xrange(17))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the `q` quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.BOUNDS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.statuses = {}
+        self.latency = Histogram()
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'statuses': dict(self.statuses),
+            'latency': {
+                'count': self.latency.count,
+                'sum': self.latency.sum,
+                'p50': self.latency.percentile(0.5),
+                'p95': self.latency.percentile(0.95),
+                'p99': self.latency.percentile(0.99),
+            },
+        }
+
+
+class MetricsCollector(Hook):
+    """
+    In-memory per endpoint template metrics: call counts, status codes,
+    retries, errors, bytes transferred and a latency histogram. Recording
+    is a dict lookup and a few increments under one lock.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _get(self, method, endpoint):
+        key = (method, endpoint_template(endpoint))
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats.setdefault(key, EndpointStats())
+        return stats
+
+    def before_request(self, method, endpoint, kw):
+        size = len(kw.get('data') or '')
+        with self._lock:
+            stats = self._get(method, endpoint)
+            stats.calls += 1
+            stats.bytes_sent += size
+
+    def after_response(self, method, endpoint, response, elapsed):
+        size = response_size(response)
+        with self._lock:
+            stats = self._get(method, endpoint)
+            stats.statuses[response.status_code] = stats.statuses.get(response.status_code, 0) + 1
+            stats.bytes_received += size
+            stats.latency.observe(elapsed)
+
+    def on_retry(self, method, endpoint, attempt, delay, response, error):
+        with self._lock:
+            self._get(method, endpoint).retries += 1
+
+    def on_error(self, method, endpoint, error, elapsed):
+        with self._lock:
+            stats = self._get(method, endpoint)
+            stats.errors += 1
+            stats.latency.observe(elapsed)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def to_dict(self):
+        with self._lock:
+            return dict(
+                ('{0} {1}'.format(method, template), stats.to_dict())
+                for (method, template), stats in self._stats.items()
+            )
+
+    def to_prometheus(self, prefix='airwatch'):
+        lines = []
+
+        def add(name, kind, help_text, samples):
+            lines.append('# HELP {0}_{1} {2}'.format(prefix, name, help_text))
+            lines.append('# TYPE {0}_{1} {2}'.format(prefix, name, kind))
+            for suffix, labels, value in samples:
+                lines.append('{0}_{1}{2}{{{3}}} {4}'.format(
+                    prefix, name, suffix,
+                    ','.join('{0}="{1}"'.format(k, v) for k, v in labels),
+                    value
+                ))
+
+        with self._lock:
+            items = sorted(self._stats.items())
+            requests, retries, errors, sent, received, latency = [], [], [], [], [], []
+            for (method, template), stats in items:
+                labels = [('method', method), ('endpoint', template)]
+                for status, count in sorted(stats.statuses.items()):
+                    requests.append(('', labels + [('status', status)], count))
+                retries.append(('', labels, stats.retries))
+                errors.append(('', labels, stats.errors))
+                sent.append(('', labels, stats.bytes_sent))
+                received.append(('', labels, stats.bytes_received))
+                cumulative = 0
+                for bound, count in zip(Histogram.BOUNDS, stats.latency.counts):
+                    cumulative += count
+                    latency.append(('_bucket', labels + [('le', repr(bound))], cumulative))
+                latency.append(('_bucket', labels + [('le', '+Inf')], stats.latency.count))
+                latency.append(('_sum', labels, stats.latency.sum))
+                latency.append(('_count', labels, stats.latency.count))
+
+        add('responses_total', 'counter', 'Responses by status code.', requests)
+        add('retries_total', 'counter', 'Retried attempts.', retries)
+        add('errors_total', 'counter', 'Calls failed without a response.', errors)
+        add('request_bytes_total', 'counter', 'Request body bytes sent.', sent)
+        add('response_bytes_total', 'counter', 'Response body bytes received.', received)
+        add('request_duration_seconds', 'histogram', 'Call latency including retries.', latency)
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import sqlite3
+import threading
+import time
+
+from app import App
+from concurrency import map_bounded
+from group import SmartGroup, UserGroup
+from user import User
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS objects (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    attrs TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    kind TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL
+);
+'''
+
+
+def _list_users(client):
+    for user in User.iter_search(client):
+        yield user.UserName, user.fields()
+
+
+def _list_user_groups(client):
+    for group in UserGroup.search(client):
+        yield group.UserGroupName, group.fields()
+
+
+def _list_smart_groups(client, concurrency=8):
+    smart_group_ids = [
+        smart_group.SmartGroupID
+        for smart_group in SmartGroup.iter_search(client, lazy=True)
+    ]
+    smart_groups = map_bounded(
+        lambda smart_group_id: SmartGroup.get_remote(client, smart_group_id, max_age=0),
+        smart_group_ids, concurrency
+    )
+    for smart_group in smart_groups:
+        yield smart_group.SmartGroupID, smart_group.fields()
+
+
+def _list_apps(client):
+    for app in App.iter_search(client):
+        yield app.Id['Value'], app.fields()
+
+
+class TenantMirror(object):
+    """
+    SQLite file holding the users, user groups, smart groups and apps last
+    fetched from the tenant, each row with the time it was fetched. Set as
+    `client.mirror`, the `get_remote` lookups answer from it while a row
+    is younger than `max_age` seconds and write what they fetch back, so
+    a restarted process starts from the previous snapshot instead of
+    walking every listing again.
+    """
+
+    LISTINGS = {
+        'users': _list_users,
+        'user_groups': _list_user_groups,
+        'smart_groups': _list_smart_groups,
+        'apps': _list_apps,
+    }
+
+    def __init__(self, path, max_age=300):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(_SCHEMA)
+
+    def _fresh_since(self, max_age):
+        max_age = self.max_age if max_age is None else max_age
+        return time.time() - max_age
+
+    def get(self, kind, key, max_age=None):
+        """Stored fields of one object, or None when missing or stale."""
+        if max_age == 0:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                'SELECT attrs FROM objects'
+                ' WHERE kind = ? AND key = ? AND fetched_at >= ?',
+                (kind, unicode(key), self._fresh_since(max_age))
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def all(self, kind, max_age=None):
+        """
+        Stored fields of every object of `kind`, or None when there is no
+        complete snapshot of it younger than `max_age`.
+        """
+        if max_age == 0:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                'SELECT fetched_at FROM snapshots WHERE kind = ?', (kind, )
+            ).fetchone()
+            if row is None or row[0] < self._fresh_since(max_age):
+                return None
+            rows = self._db.execute(
+                'SELECT attrs FROM objects WHERE kind = ? ORDER BY key', (kind, )
+            ).fetchall()
+        return [json.loads(attrs) for attrs, in rows]
+
+    def put(self, kind, key, attrs):
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)',
+                (kind, unicode(key), json.dumps(attrs), time.time())
+            )
+
+    def remove(self, kind, key):
+        with self._lock, self._db:
+            self._db.execute(
+                'DELETE FROM objects WHERE kind = ? AND key = ?',
+                (kind, unicode(key))
+            )
+
+    def replace(self, kind, items):
+        """
+        Store `(key, attrs)` pairs as the complete snapshot of `kind`:
+        objects stored before the snapshot started and missing from it are
+        dropped, objects written meanwhile by lookups are kept.
+        """
+        started = time.time()
+        rows = [
+            (kind, unicode(key), json.dumps(attrs), started)
+            for key, attrs in items
+        ]
+        with self._lock, self._db:
+            self._db.execute(
+                'DELETE FROM objects WHERE kind = ? AND fetched_at < ?',
+                (kind, started)
+            )
+            self._db.executemany(
+                'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)', rows
+            )
+            self._db.execute(
+                'INSERT OR REPLACE INTO snapshots VALUES (?, ?)', (kind, started)
+            )
+
+    def snapshot_age(self, kind):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT fetched_at FROM snapshots WHERE kind = ?', (kind, )
+            ).fetchone()
+        return time.time() - row[0] if row is not None else None
+
+    def refresh(self, client, kinds=None, force=False):
+        """
+        Fetch again the listings of `kinds` (all by default) whose snapshot
+        is missing or older than `max_age`, or all of them with `force`.
+        Returns the kinds that were fetched.
+        """
+        refreshed = []
+        for kind in kinds or sorted(self.LISTINGS):
+            age = self.snapshot_age(kind)
+            if not force and age is not None and age < self.max_age:
+                continue
+            self.replace(kind, list(self.LISTINGS[kind](client)))
+            refreshed.append(kind)
+        return refreshed
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fcntl
+import os
+import threading
+import time
+
+
+def _reserve(state, now, rate, burst):
+    # tokens may go negative: every caller books its token right away and
+    # then sleeps until the bucket has refilled up to it
+    tokens, stamp = state if state is not None else (burst, now)
+    tokens = min(burst, tokens + (now - stamp) * rate) - 1
+    wait = -tokens / rate if tokens < 0 else 0.0
+    return (tokens, now), wait
+
+
+class LocalBucketState(object):
+    """Bucket state shared by the threads of one process."""
+
+    def __init__(self):
+        self._state = None
+        self._lock = threading.Lock()
+
+    def reserve(self, rate, burst):
+        with self._lock:
+            self._state, wait = _reserve(self._state, time.time(), rate, burst)
+        return wait
+
+
+class FileBucketState(object):
+    """
+    Bucket state kept in a file under an exclusive lock, shared by every
+    process on the host that uses the same `path`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def reserve(self, rate, burst):
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                content = os.read(fd, 64)
+                try:
+                    state = tuple(float(v) for v in content.split())
+                    if len(state) != 2:
+                        state = None
+                except ValueError:
+                    state = None
+                state, wait = _reserve(state, time.time(), rate, burst)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, '{0!r} {1!r}'.format(*state))
+            finally:
+                os.close(fd)
+        return wait
+
+
+class TokenBucket(object):
+    """
+    Rate limiter allowing `rate` requests per second on average with bursts
+    of up to `burst` requests. Give `path` to share the budget between the
+    processes of one host through a locked file.
+    """
+
+    def __init__(self, rate, burst=None, path=None):
+        if rate <= 0:
+            raise ValueError('TokenBucket rate must be positive')
+        self.rate = float(rate)
+        self.burst = burst if burst is not None else max(1, int(rate))
+        self._state = FileBucketState(path) if path else LocalBucketState()
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.delayed = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self):
+        """Block until a request may be sent, return the seconds waited."""
+        wait = self._state.reserve(self.rate, self.burst)
+        if wait > 0:
+            time.sleep(wait)
+        with self._stats_lock:
+            self.calls += 1
+            if wait > 0:
+                self.delayed += 1
+                self.waited += wait
+                self.max_wait = max(self.max_wait, wait)
+        return wait
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'calls': self.calls,
+                'delayed': self.delayed,
+                'waited': self.waited,
+                'max_wait': self.max_wait,
+            }
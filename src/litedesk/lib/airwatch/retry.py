@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import calendar
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+
+class RetryBudget(object):
+    """
+    Client-wide allowance of retries. Every request deposits `ratio` of a
+    retry, every retry withdraws a whole one, so retries stay a bounded
+    fraction of the traffic. At most `reserve` retries can be saved up.
+    """
+
+    def __init__(self, ratio=0.2, reserve=10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self._balance = float(reserve)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self._balance + self.ratio, self.reserve)
+
+    def withdraw(self):
+        with self._lock:
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+
+class RetryPolicy(object):
+    """
+    Decides whether and when a failed call is retried.
+
+    Connection errors, timeouts and responses with a status in
+    `status_codes` are retried up to `max_attempts` times in total with
+    full-jitter exponential delays, honoring `Retry-After` when the server
+    sends it. No retry starts after `max_elapsed` seconds or when the
+    `budget` is exhausted.
+
+    Calls with a method outside `IDEMPOTENT_METHODS` may already have
+    taken effect, so they are retried only when the server throttled
+    them (429 or `Retry-After`) or the connection was never made.
+    """
+
+    RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+    IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+    def __init__(self, max_attempts=4, backoff=0.5, max_backoff=30,
+                 max_elapsed=60, status_codes=(429, 502, 503, 504),
+                 budget=None):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_elapsed = max_elapsed
+        self.status_codes = frozenset(status_codes)
+        self.budget = budget if budget is not None else RetryBudget()
+
+    def is_retryable(self, response=None, error=None, method=None):
+        idempotent = method is None or method.upper() in self.IDEMPOTENT_METHODS
+        if error is not None:
+            if not idempotent:
+                return isinstance(error, requests.ConnectTimeout)
+            return isinstance(error, self.RETRY_EXCEPTIONS)
+        if response.status_code not in self.status_codes:
+            return False
+        return (
+            idempotent or response.status_code == 429
+            or self.retry_after(response) is not None
+        )
+
+    @staticmethod
+    def retry_after(response):
+        if response is None:
+            return None
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0, float(value))
+        except ValueError:
+            date = email.utils.parsedate(value)
+            if date is None:
+                return None
+            return max(0, calendar.timegm(date) - time.time())
+
+    def delay(self, attempt, response=None):
+        retry_after = self.retry_after(response)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_backoff, self.backoff * pow(2, attempt)))
+
+    def next_delay(self, attempt, started, response=None, error=None,
+                   method=None):
+        """
+        Delay before retrying after failed attempt number `attempt`
+        (counting from 0) of a `method` call, or None when the call must
+        not be retried.
+        """
+        if attempt + 1 >= self.max_attempts:
+            return None
+        if not self.is_retryable(response, error, method):
+            return None
+        delay = self.delay(attempt, response)
+        if time.time() + delay - started > self.max_elapsed:
+            return None
+        if not self.budget.withdraw():
+            return None
+        return delay
+
+
+class NoRetry(RetryPolicy):
+    def __init__(self):
+        super(NoRetry, self).__init__(max_attempts=1)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import threading
+import time
+
+from metrics import Histogram
+
+
+class _Waiter(object):
+    __slots__ = ('rank', 'traffic_class', 'enqueued', 'seq', 'event')
+
+    def __init__(self, rank, traffic_class, seq):
+        self.rank = rank
+        self.traffic_class = traffic_class
+        self.enqueued = time.time()
+        self.seq = seq
+        self.event = threading.Event()
+
+
+class ClassStats(object):
+    def __init__(self):
+        self.queued = 0
+        self.max_queued = 0
+        self.dispatched = 0
+        self.wait = Histogram()
+        self.max_wait = 0.0
+
+    def to_dict(self):
+        return {
+            'queued': self.queued,
+            'max_queued': self.max_queued,
+            'dispatched': self.dispatched,
+            'wait_sum': self.wait.sum,
+            'wait_p50': self.wait.percentile(0.5),
+            'wait_p95': self.wait.percentile(0.95),
+            'max_wait': self.max_wait,
+        }
+
+
+class RequestScheduler(object):
+    """
+    At most `slots` requests on the wire at once, the others wait for a
+    slot by traffic class: `classes` go from the most to the least
+    urgent. A freed slot goes to the waiter of the most urgent class,
+    first come first served within a class. Waiting `aging` seconds
+    counts as much as one class up, so bulk work still gets slots while
+    interactive calls keep coming.
+    """
+
+    CLASSES = ('interactive', 'default', 'bulk')
+
+    def __init__(self, slots=8, classes=CLASSES, aging=5.0):
+        if slots < 1:
+            raise ValueError('RequestScheduler needs at least one slot')
+        self.slots = slots
+        self.classes = tuple(classes)
+        self.aging = aging
+        self._ranks = dict((name, rank) for rank, name in enumerate(self.classes))
+        self._free = slots
+        self._waiters = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._stats = dict((name, ClassStats()) for name in self.classes)
+
+    def _rank(self, traffic_class):
+        try:
+            return self._ranks[traffic_class]
+        except KeyError:
+            raise ValueError('Unknown traffic class {0!r}, expected one of {1}'.format(
+                traffic_class, ', '.join(self.classes)
+            ))
+
+    def _dispatched(self, traffic_class, waited):
+        stats = self._stats[traffic_class]
+        stats.dispatched += 1
+        stats.wait.observe(waited)
+        stats.max_wait = max(stats.max_wait, waited)
+
+    def acquire(self, traffic_class='default'):
+        """Wait for a slot, returns the seconds waited."""
+        rank = self._rank(traffic_class)
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                self._dispatched(traffic_class, 0.0)
+                return 0.0
+            waiter = _Waiter(rank, traffic_class, next(self._seq))
+            self._waiters.append(waiter)
+            stats = self._stats[traffic_class]
+            stats.queued += 1
+            stats.max_queued = max(stats.max_queued, stats.queued)
+        waiter.event.wait()
+        return time.time() - waiter.enqueued
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self._free += 1
+                return
+            now = time.time()
+            aging = float(self.aging) if self.aging else None
+            waiter = min(self._waiters, key=lambda w: (
+                w.rank - (now - w.enqueued) / aging if aging else w.rank, w.seq
+            ))
+            self._waiters.remove(waiter)
+            self._stats[waiter.traffic_class].queued -= 1
+            self._dispatched(waiter.traffic_class, now - waiter.enqueued)
+        # the slot passes straight to the waiter
+        waiter.event.set()
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                (name, stats.to_dict()) for name, stats in self._stats.items()
+            )
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import multiprocessing
+import os
+import pickle
+import Queue
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+
+from client import Client
+from ratelimit import TokenBucket
+
+
+class Tenant(object):
+    """
+    Connection settings of one tenant and its limits: at most
+    `concurrency` calls of a pool run at once and, with `rate`, requests
+    are throttled to `rate` per second. Other keywords go to Client.
+    """
+
+    def __init__(self, name, server_url, username, password, api_token,
+                 concurrency=4, rate=None, burst=None, rate_limit_path=None,
+                 **client_kw):
+        self.name = name
+        self.server_url = server_url
+        self.username = username
+        self.password = password
+        self.api_token = api_token
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.rate_limit_path = rate_limit_path
+        self.client_kw = client_kw
+
+    def client(self):
+        rate_limiter = None
+        if self.rate:
+            rate_limiter = TokenBucket(self.rate, self.burst, self.rate_limit_path)
+        return Client(
+            self.server_url, self.username, self.password, self.api_token,
+            rate_limiter=rate_limiter, **self.client_kw
+        )
+
+    def __repr__(self):
+        return '<Tenant {0}>'.format(self.name)
+
+
+class TenantResult(object):
+    """
+    Outcome of one call for one tenant. `elapsed` is the time the call
+    took, `finished` the time since the run started when it completed.
+    """
+
+    def __init__(self, tenant, item, result=None, error=None, elapsed=0.0,
+                 finished=0.0):
+        self.tenant = tenant
+        self.item = item
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+        self.finished = finished
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<TenantResult {0} {1} {2:.3f}s>'.format(
+            self.tenant, 'ok' if self.ok else repr(self.error), self.elapsed
+        )
+
+
+class _Operation(object):
+    # picklable `func(client, *args, **kw)` ignoring the item
+    def __init__(self, func, args, kw):
+        self.func = func
+        self.args = args
+        self.kw = kw
+
+    def __call__(self, client, item):
+        return self.func(client, *self.args, **self.kw)
+
+
+def _picklable(error):
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return Exception(repr(error))
+
+
+_worker_clients = {}
+
+
+def _init_worker():
+    _worker_clients.clear()
+
+
+def _run_in_worker(task):
+    tenant, func, item = task
+    client = _worker_clients.get(tenant.name)
+    if client is None:
+        client = _worker_clients[tenant.name] = tenant.client()
+    started = time.time()
+    try:
+        return tenant.name, item, func(client, item), None, time.time() - started
+    except Exception, e:
+        return tenant.name, item, None, _picklable(e), time.time() - started
+
+
+class TenantPool(object):
+    """
+    One Client per tenant and a pool of `workers` threads (or processes
+    with `processes`) running calls across all of them. Tenants take
+    turns for free workers and never run more than their own
+    `concurrency` calls at once, so a tenant with a long queue or slow
+    responses does not hold up the others.
+
+    In process mode every process builds its own clients, `func` and the
+    items must be picklable, and tenants with a `rate` share one token
+    bucket file between processes.
+    """
+
+    def __init__(self, tenants, workers=8, processes=False):
+        self.tenants = OrderedDict((tenant.name, tenant) for tenant in tenants)
+        self.workers = workers
+        self.processes = processes
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self._rate_dir = None
+        if processes:
+            # processes throttle a tenant together through a bucket file
+            self._rate_dir = tempfile.mkdtemp(prefix='airwatch-tenants-')
+            for index, name in enumerate(self.tenants):
+                tenant = self.tenants[name]
+                if tenant.rate and tenant.rate_limit_path is None:
+                    tenant = self.tenants[name] = copy.copy(tenant)
+                    tenant.rate_limit_path = os.path.join(
+                        self._rate_dir, '{0}.bucket'.format(index)
+                    )
+        self.elapsed = None
+        self.timings = {}
+
+    def client(self, name):
+        with self._clients_lock:
+            client = self._clients.get(name)
+            if client is None:
+                client = self._clients[name] = self.tenants[name].client()
+            return client
+
+    def run(self, func, *args, **kw):
+        """
+        Call `func(client, *args, **kw)` once for every tenant and yield
+        a TenantResult per tenant as each one completes.
+        """
+        return self.map(
+            _Operation(func, args, kw),
+            dict((name, [None]) for name in self.tenants)
+        )
+
+    def map(self, func, items_by_tenant):
+        """
+        Call `func(client, item)` for the items listed for each tenant and
+        yield a TenantResult per call as they complete. `timings` holds
+        per tenant figures and `elapsed` the wall time once the run is over.
+        """
+        queues = OrderedDict(
+            (name, deque(items_by_tenant.get(name) or ()))
+            for name in self.tenants
+        )
+        self.timings = dict(
+            (name, {'calls': 0, 'errors': 0, 'busy': 0.0, 'finished': None})
+            for name in self.tenants
+        )
+        started = time.time()
+        if self.processes:
+            results = self._map_processes(func, queues)
+        else:
+            results = self._map_threads(func, queues)
+        for name, item, result, error, elapsed in results:
+            finished = time.time() - started
+            timing = self.timings[name]
+            timing['calls'] += 1
+            timing['errors'] += error is not None
+            timing['busy'] += elapsed
+            timing['finished'] = finished
+            yield TenantResult(name, item, result, error, elapsed, finished)
+        self.elapsed = time.time() - started
+
+    def _next_task(self, queues, running, turns):
+        # the first tenant in turn with work and a free slot, which then
+        # goes to the back of the line
+        for _ in xrange(len(turns)):
+            name = turns[0]
+            turns.rotate(-1)
+            if queues[name] and running[name] < self.tenants[name].concurrency:
+                running[name] += 1
+                return name, queues[name].popleft()
+        return None
+
+    def _map_threads(self, func, queues):
+        condition = threading.Condition()
+        running = dict.fromkeys(queues, 0)
+        turns = deque(queues)
+        done = deque()
+        total = sum(len(queue) for queue in queues.values())
+
+        def next_task():
+            return self._next_task(queues, running, turns)
+
+        def work():
+            while True:
+                with condition:
+                    task = next_task()
+                    while task is None:
+                        if not any(queues.values()):
+                            return
+                        condition.wait()
+                        task = next_task()
+                name, item = task
+                call_started = time.time()
+                try:
+                    outcome = (name, item, func(self.client(name), item), None)
+                except Exception, e:
+                    outcome = (name, item, None, e)
+                with condition:
+                    running[name] -= 1
+                    done.append(outcome + (time.time() - call_started, ))
+                    condition.notify_all()
+
+        threads = [
+            threading.Thread(target=work)
+            for _ in xrange(min(self.workers, total))
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for _ in xrange(total):
+            with condition:
+                while not done:
+                    condition.wait()
+                outcome = done.popleft()
+            yield outcome
+
+    def _map_processes(self, func, queues):
+        # the parent hands out a task only to a tenant under its
+        # concurrency, so no worker process sits waiting for a slot
+        running = dict.fromkeys(queues, 0)
+        turns = deque(queues)
+        total = sum(len(queue) for queue in queues.values())
+        if not total:
+            return
+        workers = min(self.workers, total)
+        done = Queue.Queue()
+        pending = {}
+        keys = iter(xrange(total))
+        pool = multiprocessing.Pool(workers, _init_worker)
+        try:
+            for _ in xrange(total):
+                while len(pending) < workers:
+                    task = self._next_task(queues, running, turns)
+                    if task is None:
+                        break
+                    name, item = task
+                    key = next(keys)
+                    pending[key] = name, item, pool.apply_async(
+                        _run_in_worker, ((self.tenants[name], func, item), ),
+                        callback=lambda outcome, key=key: done.put((key, outcome))
+                    )
+                key, outcome = self._next_outcome(done, pending)
+                running[pending.pop(key)[0]] -= 1
+                yield outcome
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @staticmethod
+    def _next_outcome(done, pending):
+        while True:
+            try:
+                return done.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+            # a task that failed to pickle never calls back
+            for key, (name, item, result) in pending.items():
+                if result.ready() and not result.successful():
+                    try:
+                        result.get()
+                    except Exception, e:
+                        return key, (name, item, None, _picklable(e), 0.0)
+
+    def close(self):
+        with self._clients_lock:
+            clients, self._clients = self._clients.values(), {}
+        for client in clients:
+            client.close()
+        if self._rate_dir is not None:
+            shutil.rmtree(self._rate_dir, ignore_errors=True)
+            self._rate_dir = None
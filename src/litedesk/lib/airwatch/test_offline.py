@@ -0,0 +1,1332 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tests running against the in-process FakeAirWatch, no tenant needed:
+
+    python -m unittest test_offline
+"""
+
+import argparse
+import itertools
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import requests
+from requests.exceptions import HTTPError
+from requests.models import Response
+
+from app import App, AppCatalogIndex
+from benchmark import WORKFLOWS, run_workflow
+from cache import ResponseCache
+from client import AsyncClient, Client
+from device import Device
+from deviceindex import DeviceIndex
+from directory import UserDirectory
+from fakeserver import FakeAirWatch, FakeAirWatchServer
+from group import SmartGroup, UserGroup, UserGroupHacked
+from jsonstream import iter_json_array
+from metrics import MetricsCollector, endpoint_template
+from mirror import TenantMirror
+from ratelimit import TokenBucket
+from retry import NoRetry, RetryBudget, RetryPolicy
+from scheduler import RequestScheduler
+from tenants import Tenant, TenantPool
+from transport import (
+    RecordingTransport, ReplayMissError, ReplayTransport, iter_capture, summarize
+)
+from user import User, UserAlreadyRegisteredError, UserNotFoundError
+from workflow import OnboardingPipeline
+
+
+def _response(status, body='{}', headers=None):
+    response = _Response()
+    response.status_code = status
+    response._content = body
+    response.headers.update(headers or {})
+    return response
+
+
+class _Response(Response):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class _ScriptedTransport(object):
+    # answers with the given statuses in turn, then 200
+    def __init__(self, *statuses, **kw):
+        self.statuses = list(statuses)
+        self.headers = kw.get('headers')
+        self.responses = []
+
+    def request(self, method, url, **kw):
+        status = self.statuses.pop(0) if self.statuses else 200
+        if isinstance(status, Exception):
+            raise status
+        self.responses.append(_response(status, headers=self.headers))
+        return self.responses[-1]
+
+
+class _DebouncedGroup(UserGroupHacked):
+    debounce = 0.2
+
+
+def _sleep_and_return(client, item):
+    time.sleep(item)
+    return item
+
+
+class FakeTenantTestCase(unittest.TestCase):
+    """Serves a populated FakeAirWatch for every test."""
+
+    populate = {'users': 10, 'user_groups': 1, 'smart_groups': 2, 'apps': 4,
+                'devices': 6}
+
+    def setUp(self):
+        self.fake = FakeAirWatch(seed=1)
+        self.fake.populate(**self.populate)
+        self.server = FakeAirWatchServer(self.fake).start()
+        self.client = self.make_client()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def make_client(self, cls=Client, **kw):
+        return cls(self.server.url, 'admin', 'password', 'token', **kw)
+
+    def requests_to(self, name):
+        return self.fake.requests.get(name, 0)
+
+
+class FakeAirWatchTestCase(FakeTenantTestCase):
+
+    def setUp(self):
+        super(FakeAirWatchTestCase, self).setUp()
+        self.client.retry_policy = NoRetry()
+
+    def test_searches_are_paged(self):
+        response = self.client.call_api(
+            'GET', 'system/users/search', params={'page': 2, 'pagesize': 4}
+        )
+        body = response.json()
+        self.assertEqual([u['UserName'] for u in body['Users']], ['user8', 'user9'])
+        self.assertEqual(body['Total'], 10)
+
+    def test_throttled_requests_get_retry_after(self):
+        self.fake.throttle_rate = 1
+        self.fake.retry_after = 3
+        response = self.client.call_api('GET', 'system/users/search')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '3')
+
+    def test_injected_errors(self):
+        self.fake.error_rate = 1
+        self.assertEqual(self.client.call_api('GET', 'mam/apps/search').status_code, 500)
+
+    def test_requests_counted_by_endpoint_template(self):
+        user = self.fake.users.values()[0]
+        self.fake.reset_counters()
+        endpoint = 'system/users/{0}/activate'.format(user['Id']['Value'])
+        self.assertEqual(self.client.call_api('POST', endpoint).status_code, 200)
+        self.assertEqual(self.client.call_api('POST', endpoint).status_code, 400)
+        self.assertEqual(self.client.call_api('GET', 'nowhere').status_code, 404)
+        self.assertEqual(self.requests_to('POST system/users/{id}/activate'), 2)
+        self.assertEqual(self.fake.request_count, 3)
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def test_every_workflow_runs(self):
+        options = argparse.Namespace(
+            latency=0.0, error_rate=0.0, throttle_rate=0.0, users=5,
+            smart_groups=2, apps=3, concurrency=2
+        )
+        for name, setup in WORKFLOWS:
+            result = run_workflow(setup, options)
+            self.assertGreater(result['requests'], 0, name)
+            self.assertEqual(sum(result['by_endpoint'].values()), result['requests'])
+
+
+class AsyncClientTestCase(FakeTenantTestCase):
+
+    def setUp(self):
+        super(AsyncClientTestCase, self).setUp()
+        self.async_client = self.make_client(AsyncClient, max_in_flight=3)
+
+    def tearDown(self):
+        self.async_client.close()
+        super(AsyncClientTestCase, self).tearDown()
+
+    def test_async_methods_return_futures(self):
+        futures = [
+            App.search_async(self.async_client),
+            self.async_client.call_api_async('GET', 'system/users/search'),
+        ]
+        apps, response = self.async_client.gather(futures)
+        self.assertEqual(len(apps), 4)
+        self.assertEqual(response.json()['Total'], 10)
+
+    def test_calls_in_flight_are_bounded(self):
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def call():
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+        self.async_client.gather([self.async_client.submit(call) for _ in xrange(12)])
+        self.assertEqual(running[1], 3)
+
+    def test_gather_returns_exceptions(self):
+        def fail():
+            raise ValueError('no')
+        results = self.async_client.gather(
+            [self.async_client.submit(fail), self.async_client.submit(lambda: 1)],
+            return_exceptions=True
+        )
+        self.assertIsInstance(results[0], ValueError)
+        self.assertEqual(results[1], 1)
+        self.assertRaises(ValueError, self.async_client.submit(fail).result)
+
+
+class UserBatchTestCase(FakeTenantTestCase):
+
+    populate = {'users': 30}
+
+    def test_create_many_lists_users_once(self):
+        self.fake.reset_counters()
+        usernames = ['user1'] + ['new{0}'.format(i) for i in xrange(25)]
+        results = User.create_many(self.client, usernames)
+        self.assertEqual([r.ok for r in results], [False] + [True] * 25)
+        self.assertTrue(all(r.user.id is not None for r in results[1:]))
+        self.assertEqual(self.requests_to('GET system/users/search'), 1)
+        self.assertEqual(self.requests_to('POST system/users/adduser'), 25)
+
+    def test_results_per_username_in_input_order(self):
+        results = User.activate_many(self.client, ['user2', 'nobody', 'user1', 'user2'])
+        self.assertEqual([r.username for r in results], ['user2', 'nobody', 'user1'])
+        self.assertEqual([r.ok for r in results], [True, False, True])
+        self.assertIsInstance(results[1].error, UserNotFoundError)
+        User.delete_many(self.client, ['user1'])
+        self.assertNotIn(
+            'user1', [u['UserName'] for u in self.fake.users.values()]
+        )
+        self.assertEqual(
+            [u['Status'] for u in self.fake.users.values() if u['UserName'] == 'user2'],
+            [True]
+        )
+
+
+class PagingTestCase(FakeTenantTestCase):
+
+    populate = {'users': 25, 'devices': 3}
+
+    def test_every_page_walked_once(self):
+        self.fake.reset_counters()
+        usernames = [u.UserName for u in User.iter_search(self.client, pagesize=10)]
+        self.assertEqual(usernames, ['user{0}'.format(i) for i in xrange(25)])
+        self.assertEqual(self.requests_to('GET system/users/search'), 3)
+
+    def test_prefetch_yields_the_same_items(self):
+        expected = [u.UserName for u in User.iter_search(self.client, pagesize=7)]
+        self.fake.reset_counters()
+        prefetched = [
+            u.UserName for u in User.iter_search(self.client, pagesize=7, prefetch=True)
+        ]
+        self.assertEqual(prefetched, expected)
+        self.assertEqual(self.requests_to('GET system/users/search'), 4)
+
+    def test_stopping_early_fetches_no_more_pages(self):
+        self.fake.reset_counters()
+        users = list(itertools.islice(User.iter_search(self.client, pagesize=10), 5))
+        self.assertEqual(len(users), 5)
+        self.assertEqual(self.requests_to('GET system/users/search'), 1)
+
+    def test_filters_and_empty_results(self):
+        self.assertEqual(
+            [d.UserName for d in Device.iter_search(self.client, user='user1')],
+            ['user1']
+        )
+        self.assertEqual(list(Device.iter_search(self.client, user='nobody')), [])
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def test_ttl_of_longest_prefix(self):
+        cache = ResponseCache(ttl=60, ttls={'mdm': 10, 'mdm/devices/': 0})
+        self.assertEqual(cache.ttl_for('system/users/search'), 60)
+        self.assertEqual(cache.ttl_for('mdm/smartgroups/search'), 10)
+        self.assertEqual(cache.ttl_for('mdm/devices/search'), 0)
+
+    def test_expired_entries_are_misses(self):
+        cache = ResponseCache(ttl=0)
+        cache.set('system/users/search', None, _response(200))
+        self.assertIsNone(cache.get('system/users/search'))
+        self.assertEqual(cache.misses, 1)
+
+    def test_invalidate_related_resources(self):
+        cache = ResponseCache()
+        for endpoint in ('system/usergroups/1/users', 'mdm/smartgroups/search',
+                         'system/users/search'):
+            cache.set(endpoint, None, _response(200))
+        before = cache.generation('mdm/smartgroups/2')
+        cache.invalidate('system/usergroups/1/user/2/addusertogroup')
+        self.assertIsNone(cache.get('system/usergroups/1/users'))
+        self.assertIsNone(cache.get('mdm/smartgroups/search'))
+        self.assertIsNotNone(cache.get('system/users/search'))
+        self.assertNotEqual(cache.generation('mdm/smartgroups/2'), before)
+
+    def test_least_recently_used_evicted(self):
+        cache = ResponseCache(max_bytes=10)
+        cache.set('a/1', None, _response(200, '12345'))
+        cache.set('a/2', None, _response(200, '12345'))
+        cache.get('a/1')
+        cache.set('a/3', None, _response(200, '12345'))
+        self.assertIsNotNone(cache.get('a/1'))
+        self.assertIsNone(cache.get('a/2'))
+        self.assertEqual(cache.size, 10)
+
+
+class ClientCacheTestCase(FakeTenantTestCase):
+
+    def test_gets_cached_until_a_change(self):
+        client = self.make_client(cache=ResponseCache())
+        self.fake.reset_counters()
+        for _ in xrange(3):
+            User.get_remote(client, 'user1')
+        self.assertEqual(self.requests_to('GET system/users/search'), 1)
+        User.get_remote(client, 'user1').activate()
+        self.assertTrue(User.get_remote(client, 'user1').Status)
+        self.assertEqual(self.requests_to('GET system/users/search'), 2)
+
+    def test_user_group_memo_expires_with_cache(self):
+        client = self.make_client(cache=ResponseCache(ttl=0.2))
+        group = UserGroup.get_remote(client, 'group0')
+        user = User.get_remote(client, 'user0')
+        group.add_member(user)
+        other = self.make_client()
+        UserGroup.get_remote(other, 'group0').remove_member(User.get_remote(other, 'user0'))
+        time.sleep(0.3)
+        group.add_member(user)
+        self.assertIn('user0', UserGroup.usernames_by_group_id(client, group.UserGroupId))
+
+
+class SmartGroupFetchTestCase(FakeTenantTestCase):
+
+    populate = {'users': 30, 'user_groups': 1, 'smart_groups': 3}
+
+    def test_lazy_search_loads_details_on_demand(self):
+        self.fake.reset_counters()
+        smart_groups = SmartGroup.search(self.client, lazy=True)
+        self.assertEqual(len(smart_groups), 3)
+        self.assertEqual(self.fake.request_count, 1)
+        self.assertEqual(smart_groups[0].UserGroups[0]['Name'], 'group0')
+        self.assertEqual(self.requests_to('GET mdm/smartgroups/{id}'), 1)
+
+    def test_get_many_looks_up_few_users(self):
+        self.fake.reset_counters()
+        users = User.get_many(self.client, ['user1', 'user2', 'nobody'])
+        self.assertEqual(sorted(users), ['user1', 'user2'])
+        self.assertEqual(self.requests_to('GET system/users/search'), 3)
+
+    def test_small_smart_group_members_looked_up(self):
+        users = list(User.iter_search(self.client))
+        smart_group = SmartGroup.search(self.client)[0]
+        smart_group.add_members(users[:2])
+        self.fake.reset_counters()
+        self.assertEqual(
+            [m.UserName for m in smart_group.members],
+            [u['Name'] for u in smart_group.UserAdditions]
+        )
+        self.assertEqual(self.requests_to('GET system/users/search'), 2)
+
+    def test_large_smart_group_members_listed(self):
+        users = list(User.iter_search(self.client))
+        smart_group = SmartGroup.search(self.client)[0]
+        smart_group.add_members(users[:User.LOOKUP_LIMIT + 1])
+        self.fake.reset_counters()
+        self.assertEqual(len(smart_group.members), User.LOOKUP_LIMIT + 1)
+        self.assertEqual(self.requests_to('GET system/users/search'), 1)
+
+
+class AppCatalogIndexTestCase(FakeTenantTestCase):
+
+    def setUp(self):
+        super(AppCatalogIndexTestCase, self).setUp()
+        self.first, self.second = sorted(self.fake.smart_groups)
+        self.catalog = AppCatalogIndex(self.client)
+
+    def names(self, smart_group_id):
+        return sorted(
+            app.ApplicationName
+            for app in self.catalog.apps_for_smart_group(smart_group_id)
+        )
+
+    def test_apps_indexed_by_smart_group(self):
+        self.fake.reset_counters()
+        smart_group = SmartGroup.get_remote(self.client, self.first)
+        self.assertEqual(self.names(self.first), ['app0', 'app2'])
+        self.assertEqual(
+            sorted(app.ApplicationName for app in smart_group.apps_in(self.catalog)),
+            ['app0', 'app2']
+        )
+        self.assertEqual(self.requests_to('GET mam/apps/search'), 0)
+
+    def test_smart_group_changes_update_index_in_place(self):
+        first = SmartGroup.get_remote(self.client, self.first)
+        second = SmartGroup.get_remote(self.client, self.second)
+        app = [a for a in self.catalog if a.ApplicationName == 'app0'][0]
+        self.fake.reset_counters()
+        app.add_smart_group(second)
+        app.delete_smart_group(first)
+        self.assertEqual(self.names(self.first), ['app2'])
+        self.assertEqual(self.names(self.second), ['app0', 'app1', 'app3'])
+        self.assertEqual(self.requests_to('GET mam/apps/search'), 0)
+
+    def test_refresh_applies_changes(self):
+        app_ids = dict(
+            (app['ApplicationName'], app_id) for app_id, app in self.fake.apps.items()
+        )
+        del self.fake.apps[app_ids['app0']]
+        self.fake.apps[app_ids['app1']]['SmartGroups'] = []
+        self.fake.add_app('app4', smart_groups=[self.fake.smart_groups[self.first]])
+        self.catalog.refresh()
+        self.assertEqual(len(self.catalog), 4)
+        self.assertIsNone(self.catalog.get(app_ids['app0']))
+        self.assertEqual(self.names(self.first), ['app2', 'app4'])
+        self.assertEqual(self.names(self.second), ['app3'])
+
+    def test_refresh_app_drops_deleted_app(self):
+        app_id = sorted(self.fake.apps)[0]
+        del self.fake.apps[app_id]
+        self.assertIsNone(self.catalog.refresh_app(app_id))
+        self.assertIsNone(self.catalog.get(app_id))
+        self.assertEqual(len(self.catalog), 3)
+
+
+class RetryPolicyTestCase(unittest.TestCase):
+
+    def test_idempotent_methods_retry_server_errors(self):
+        policy = RetryPolicy()
+        for method in ('GET', 'PUT', 'DELETE'):
+            self.assertTrue(policy.is_retryable(_response(503), None, method))
+            self.assertTrue(policy.is_retryable(None, requests.ConnectionError(), method))
+        self.assertFalse(policy.is_retryable(_response(500), None, 'GET'))
+
+    def test_post_retried_only_when_throttled(self):
+        policy = RetryPolicy()
+        self.assertFalse(policy.is_retryable(_response(503), None, 'POST'))
+        self.assertFalse(policy.is_retryable(None, requests.ReadTimeout(), 'POST'))
+        self.assertTrue(policy.is_retryable(_response(429), None, 'POST'))
+        self.assertTrue(policy.is_retryable(
+            _response(503, headers={'Retry-After': '1'}), None, 'POST'
+        ))
+        self.assertTrue(policy.is_retryable(None, requests.ConnectTimeout(), 'POST'))
+
+    def test_retry_after_is_honored(self):
+        policy = RetryPolicy(max_elapsed=60)
+        response = _response(429, headers={'Retry-After': '7'})
+        self.assertEqual(policy.next_delay(0, time.time(), response, None, 'GET'), 7)
+
+    def test_attempts_elapsed_and_budget(self):
+        policy = RetryPolicy(max_attempts=2, budget=RetryBudget(ratio=0, reserve=1))
+        started = time.time()
+        self.assertIsNone(policy.next_delay(1, started, _response(503), None, 'GET'))
+        response = _response(503, headers={'Retry-After': '120'})
+        self.assertIsNone(policy.next_delay(0, started, response, None, 'GET'))
+        self.assertIsNotNone(policy.next_delay(0, started, _response(503), None, 'GET'))
+        self.assertIsNone(policy.next_delay(0, started, _response(503), None, 'GET'))
+
+    def test_client_retries_get_until_success(self):
+        transport = _ScriptedTransport(503, requests.ConnectionError(), 502)
+        client = Client('http://fake', 'a', 'b', 'c', transport=transport,
+                        retry_policy=RetryPolicy(backoff=0))
+        self.assertEqual(client.call_api('GET', 'system/users/search').status_code, 200)
+        self.assertEqual(len(transport.responses), 3)
+
+    def test_client_does_not_repeat_post(self):
+        transport = _ScriptedTransport(503, 503)
+        client = Client('http://fake', 'a', 'b', 'c', transport=transport,
+                        retry_policy=RetryPolicy(backoff=0))
+        self.assertEqual(client.call_api('POST', 'system/users/adduser').status_code, 503)
+        self.assertEqual(len(transport.responses), 1)
+
+
+class TokenBucketTestCase(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=50, burst=3)
+        started = time.time()
+        waits = [bucket.acquire() for _ in xrange(5)]
+        self.assertEqual(waits[:3], [0, 0, 0])
+        self.assertTrue(all(wait > 0 for wait in waits[3:]))
+        self.assertGreaterEqual(time.time() - started, 0.03)
+        self.assertEqual(bucket.stats()['delayed'], 2)
+
+    def test_shared_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'bucket')
+            first, second = TokenBucket(10, 2, path), TokenBucket(10, 2, path)
+            self.assertEqual(first.acquire(), 0)
+            self.assertEqual(second.acquire(), 0)
+            self.assertGreater(first.acquire(), 0)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_client_requests_throttled(self):
+        bucket = TokenBucket(rate=100, burst=1)
+        client = Client('http://fake', 'a', 'b', 'c', transport=_ScriptedTransport(),
+                        rate_limiter=bucket)
+        for _ in xrange(3):
+            client.call_api('POST', 'system/users/adduser')
+        self.assertEqual(bucket.stats()['calls'], 3)
+        self.assertEqual(bucket.stats()['delayed'], 2)
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_endpoint_template(self):
+        self.assertEqual(endpoint_template('system/users/42/activate'),
+                         'system/users/{id}/activate')
+        self.assertEqual(endpoint_template('/mdm/devices/udid/{0}/apps'.format('a1' * 20)),
+                         'mdm/devices/udid/{id}/apps')
+        self.assertEqual(endpoint_template('mam/apps/search'), 'mam/apps/search')
+
+    def make_client(self, metrics, *statuses):
+        return Client('http://fake', 'a', 'b', 'c', hooks=[metrics],
+                      transport=_ScriptedTransport(*statuses),
+                      retry_policy=RetryPolicy(backoff=0, max_attempts=2))
+
+    def test_calls_statuses_retries_and_errors(self):
+        metrics = MetricsCollector()
+        self.make_client(metrics, 503).call_api('GET', 'system/users/7')
+        self.make_client(metrics).call_api('GET', 'system/users/8')
+        client = self.make_client(metrics, requests.ConnectTimeout(), requests.ConnectTimeout())
+        self.assertRaises(requests.ConnectTimeout, client.call_api, 'POST', 'system/users/adduser')
+        stats = metrics.to_dict()
+        self.assertEqual(sorted(stats), ['GET system/users/{id}', 'POST system/users/adduser'])
+        get = stats['GET system/users/{id}']
+        self.assertEqual((get['calls'], get['retries'], get['errors']), (2, 1, 0))
+        self.assertEqual(get['statuses'], {200: 2})
+        self.assertEqual(get['latency']['count'], 2)
+        post = stats['POST system/users/adduser']
+        self.assertEqual((post['calls'], post['retries'], post['errors']), (1, 1, 1))
+        metrics.reset()
+        self.assertEqual(metrics.to_dict(), {})
+
+    def test_prometheus_output(self):
+        metrics = MetricsCollector()
+        self.make_client(metrics).call_api('POST', 'system/users/42/activate')
+        text = metrics.to_prometheus()
+        labels = 'method="POST",endpoint="system/users/{id}/activate"'
+        self.assertIn('# TYPE airwatch_responses_total counter', text)
+        self.assertIn('airwatch_responses_total{{{0},status="200"}} 1'.format(labels), text)
+        self.assertIn('airwatch_request_duration_seconds_bucket{{{0},le="+Inf"}} 1'.format(labels), text)
+        self.assertIn('airwatch_request_duration_seconds_count{{{0}}} 1'.format(labels), text)
+        self.assertTrue(text.endswith('\n'))
+
+
+class SyncMembersTestCase(FakeTenantTestCase):
+
+    def setUp(self):
+        super(SyncMembersTestCase, self).setUp()
+        self.group = UserGroup.get_remote(self.client, 'group0')
+        for username in ('user0', 'user1', 'user2'):
+            self.group.add_member(User.get_remote(self.client, username))
+        self.smart_group = SmartGroup.search(self.client)[0]
+        self.smart_group.add_members(
+            [User.get_remote(self.client, u) for u in ('user0', 'user1')]
+        )
+        self.fake.reset_counters()
+
+    def mutating_calls(self):
+        return sum(
+            count for name, count in self.fake.requests.items()
+            if not name.startswith('GET ')
+        )
+
+    def test_user_group_applies_only_differences(self):
+        report = self.group.sync_members(['user1', 'user2', 'user3', 'ghost'])
+        self.assertEqual(report.added, ['user3'])
+        self.assertEqual(report.removed, ['user0'])
+        self.assertEqual(report.unchanged, ['user1', 'user2'])
+        self.assertEqual(report.unknown, ['ghost'])
+        self.assertEqual(report.errors, {})
+        self.assertEqual(self.mutating_calls(), 2)
+        self.assertEqual(
+            sorted(UserGroup.usernames_by_group_id(self.client, self.group.UserGroupId)),
+            ['user1', 'user2', 'user3']
+        )
+
+    def test_user_group_dry_run_changes_nothing(self):
+        report = self.group.sync_members(['user3'], dry_run=True)
+        self.assertTrue(report.dry_run)
+        self.assertEqual(report.added, ['user3'])
+        self.assertEqual(report.removed, ['user0', 'user1', 'user2'])
+        self.assertEqual(self.mutating_calls(), 0)
+
+    def test_smart_group_sync_is_one_update(self):
+        report = self.smart_group.sync_members(['user1', 'user4'])
+        self.assertEqual((report.added, report.removed), (['user4'], ['user0']))
+        self.assertEqual(self.requests_to('POST mdm/smartgroups/{id}/update'), 1)
+        self.assertEqual(self.mutating_calls(), 1)
+        current = SmartGroup.get_remote(self.client, self.smart_group.SmartGroupID)
+        self.assertEqual(sorted(u['Name'] for u in current.UserAdditions), ['user1', 'user4'])
+
+    def test_smart_group_dry_run_and_no_change(self):
+        self.smart_group.sync_members(['user4'], dry_run=True)
+        report = self.smart_group.sync_members(['user0', 'user1'])
+        self.assertFalse(report.changed)
+        self.assertEqual(self.mutating_calls(), 0)
+
+
+class SmartGroupBatchTestCase(FakeTenantTestCase):
+
+    def setUp(self):
+        super(SmartGroupBatchTestCase, self).setUp()
+        self.users = list(User.iter_search(self.client))
+        self.smart_group = SmartGroup.search(self.client)[0]
+        self.fake.reset_counters()
+
+    def test_edits_sent_with_one_update(self):
+        with self.smart_group.batch():
+            for user in self.users[:5]:
+                self.smart_group.add_member(user)
+            self.smart_group.remove_member(self.users[0])
+            self.assertEqual(self.fake.request_count, 0)
+        self.assertEqual(self.requests_to('POST mdm/smartgroups/{id}/update'), 1)
+        self.assertEqual(len(self.smart_group.UserAdditions), 4)
+
+    def test_failed_batch_sends_nothing(self):
+        try:
+            with self.smart_group.batch():
+                self.smart_group.add_member(self.users[0])
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.fake.request_count, 0)
+
+    def test_flushed_after_max_edits(self):
+        with self.smart_group.batch(max_edits=2):
+            for user in self.users[:5]:
+                self.smart_group.add_member(user)
+        self.assertEqual(self.requests_to('POST mdm/smartgroups/{id}/update'), 3)
+
+    def test_batch_ages_from_oldest_edit(self):
+        with self.smart_group.batch(max_age=0.2):
+            time.sleep(0.3)
+            self.smart_group.add_member(self.users[0])
+            self.assertEqual(self.fake.request_count, 0)
+            time.sleep(0.3)
+            self.smart_group.add_member(self.users[1])
+            self.assertEqual(self.fake.request_count, 1)
+            self.smart_group.add_member(self.users[2])
+            self.assertEqual(self.fake.request_count, 1)
+        self.assertEqual(self.fake.request_count, 2)
+
+
+class UserGroupHackedTestCase(FakeTenantTestCase):
+
+    def smart_group_names(self):
+        return sorted(sg['Name'] for sg in self.fake.smart_groups.values())
+
+    def test_smart_groups_replaced_on_change(self):
+        group = UserGroupHacked.get_remote(self.client, 'group0')
+        before = sorted(self.fake.smart_groups)
+        app_groups = sorted(
+            sg['Id'] for app in self.fake.apps.values() for sg in app['SmartGroups']
+        )
+        group.add_member(User.get_remote(self.client, 'user0'))
+        self.assertEqual(self.smart_group_names(), ['smartgroup0', 'smartgroup1'])
+        self.assertFalse(set(before).intersection(self.fake.smart_groups))
+        self.assertEqual(len(app_groups), 4)
+        self.assertTrue(all(
+            sg['Id'] in self.fake.smart_groups
+            for app in self.fake.apps.values() for sg in app['SmartGroups']
+        ))
+
+    def test_replaces_from_fresh_copy(self):
+        group = UserGroupHacked.get_remote(self.client, 'group0')
+        group.add_member(User.get_remote(self.client, 'user0'))
+        smart_group = [
+            sg for sg in SmartGroup.search(self.client) if sg.Name == 'smartgroup0'
+        ][0]
+        smart_group.add_member(User.get_remote(self.client, 'user4'))
+        group.add_member(User.get_remote(self.client, 'user1'))
+        smart_group = [
+            sg for sg in SmartGroup.search(self.client) if sg.Name == 'smartgroup0'
+        ][0]
+        self.assertIn('user4', [u['Name'] for u in smart_group.UserAdditions])
+
+    def test_instances_share_one_debounced_pass(self):
+        first = _DebouncedGroup.get_remote(self.client, 'group0')
+        second = _DebouncedGroup.get_remote(self.client, 'group0')
+        self.fake.reset_counters()
+        first.add_member(User.get_remote(self.client, 'user0'))
+        second.add_member(User.get_remote(self.client, 'user1'))
+        time.sleep(0.5)
+        first.flush_replacements()
+        second.flush_replacements()
+        self.assertEqual(self.smart_group_names(), ['smartgroup0', 'smartgroup1'])
+        self.assertEqual(self.requests_to('POST mdm/smartgroups/create'), 2)
+
+    def test_flush_runs_pending_pass(self):
+        group = _DebouncedGroup.get_remote(self.client, 'group0')
+        group.add_member(User.get_remote(self.client, 'user0'))
+        self.assertEqual(self.requests_to('POST mdm/smartgroups/create'), 0)
+        _DebouncedGroup.get_remote(self.client, 'group0').flush_replacements()
+        self.assertEqual(self.requests_to('POST mdm/smartgroups/create'), 2)
+
+    def test_background_error_raised_by_any_instance(self):
+        group = _DebouncedGroup.get_remote(self.client, 'group0')
+        group.add_member(User.get_remote(self.client, 'user0'))
+        self.fake.error_rate = 1
+        time.sleep(0.4)
+        self.fake.error_rate = 0
+        other = _DebouncedGroup.get_remote(self.client, 'group0')
+        self.assertRaises(HTTPError, other.flush_replacements)
+        other.flush_replacements()
+
+
+class InstallManyTestCase(FakeTenantTestCase):
+
+    def test_results_per_device(self):
+        devices = Device.search(self.client)
+        app = App.search(self.client)[0]
+        results = list(app.install_many(devices, concurrency=3))
+        self.assertEqual(len(results), 6)
+        self.assertEqual(sorted(r.done for r in results), range(1, 7))
+        skipped = [r.device for r in results if r.status == 'skipped']
+        self.assertTrue(all(app.is_installed_on_device(d) for d in skipped))
+        installed = 6 - len(skipped)
+        self.assertEqual(
+            self.requests_to('POST mam/apps/public/{id}/install'), installed
+        )
+
+    def test_failures_reported_per_device(self):
+        devices = Device.search(self.client)
+        app = App.search(self.client)[0]
+        self.client.retry_policy = NoRetry()
+        self.fake.error_rate = 1
+        results = list(app.install_many(devices, skip_installed=False))
+        self.assertEqual(set(r.status for r in results), set(['failed']))
+        self.assertTrue(all(r.error is not None for r in results))
+
+    def test_closing_install_many_stops_installs(self):
+        self.fake.latency = 0.01
+        for i in xrange(30):
+            self.fake.add_device('user0')
+        devices = Device.search(self.client)
+        app = App.search(self.client)[0]
+        self.fake.reset_counters()
+        installs = app.install_many(devices, skip_installed=False, concurrency=2)
+        next(installs)
+        installs.close()
+        time.sleep(0.1)
+        self.assertLessEqual(self.requests_to('POST mam/apps/public/{id}/install'), 3)
+
+
+class DeviceInventoryTestCase(FakeTenantTestCase):
+
+    def test_fetch_inventories_loads_every_device(self):
+        devices = Device.fetch_inventories(Device.search(self.client), concurrency=3)
+        self.assertEqual(self.requests_to('GET mdm/devices/udid/{id}/apps'), 6)
+        for device in devices:
+            device.installed_app_ids
+        self.assertEqual(self.requests_to('GET mdm/devices/udid/{id}/apps'), 6)
+
+    def test_install_updates_fetched_inventory(self):
+        device = Device.search(self.client)[0]
+        installed = set(device.installed_app_ids)
+        app = [a for a in App.search(self.client) if a.Id['Value'] not in installed][0]
+        app.install(device)
+        self.assertTrue(app.is_installed_on_device(device))
+        results = list(app.install_many([device]))
+        self.assertEqual([r.status for r in results], ['skipped'])
+        self.assertEqual(self.requests_to('GET mdm/devices/udid/{id}/apps'), 1)
+
+
+class SlotsTestCase(FakeTenantTestCase):
+
+    def test_models_have_no_dict(self):
+        for cls in (App, Device, User, UserGroup, UserGroupHacked, SmartGroup):
+            self.assertFalse(hasattr(cls(None), '__dict__'), cls.__name__)
+
+    def test_unknown_fields_go_to_extra(self):
+        group = UserGroupHacked(None, UserGroupId=1, UserGroupName='x', Description='d')
+        self.assertEqual(group.Description, 'd')
+        self.assertEqual(
+            group.fields(), {'UserGroupId': 1, 'UserGroupName': 'x', 'Description': 'd'}
+        )
+        del group.Description
+        self.assertRaises(AttributeError, getattr, group, 'Description')
+
+    def test_packed_id(self):
+        user = User(None, Id={'Value': 7})
+        self.assertEqual(user.Id, {'Value': 7})
+        self.assertEqual(user._id, 7)
+        user.Id = 'opaque'
+        self.assertEqual(user.Id, 'opaque')
+        self.assertEqual(user.fields(), {'Id': 'opaque'})
+
+    def test_pickle_keeps_every_field(self):
+        objects = [
+            Device.search(self.client)[0],
+            User.get_remote(self.client, 'user0'),
+            UserGroupHacked(self.client, UserGroupId=1, UserGroupName='x', Description='d'),
+        ]
+        for obj in objects:
+            obj.Unlisted = [1, 2]
+            copy = pickle.loads(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+            self.assertIs(type(copy), type(obj))
+            self.assertEqual(copy.fields(), obj.fields())
+            self.assertIsNone(copy._client)
+
+    def test_mirror_keeps_extra_fields(self):
+        mirror = TenantMirror(':memory:')
+        self.client.mirror = mirror
+        group = UserGroupHacked(self.client, UserGroupId=1, UserGroupName='x', Description='d')
+        group._remember('user_groups', 'x')
+        self.assertEqual(mirror.get('user_groups', 'x')['Description'], 'd')
+
+
+class JsonStreamTestCase(unittest.TestCase):
+
+    def test_items_split_at_every_position(self):
+        body = json.dumps({'Page': 0, 'Users': [{'Id': 1}, {'Id': 22}, 3.5], 'Total': 3})
+        for size in (1, 2, 3, 7, len(body)):
+            chunks = [body[i:i + size] for i in xrange(0, len(body), size)]
+            self.assertEqual(
+                list(iter_json_array(chunks, 'Users')), [{'Id': 1}, {'Id': 22}, 3.5]
+            )
+
+    def test_missing_null_and_empty(self):
+        self.assertEqual(list(iter_json_array(['{"Total": 0}'], 'Users')), [])
+        self.assertEqual(list(iter_json_array(['{"Users": null}'], 'Users')), [])
+        self.assertEqual(list(iter_json_array(['{"Users": []}'], 'Users')), [])
+        self.assertEqual(list(iter_json_array([''], 'Users')), [])
+
+    def test_utf8_split_inside_character(self):
+        body = json.dumps({'Users': [u'J\xfcrgen']}, ensure_ascii=False).encode('utf-8')
+        chunks = [body[i:i + 1] for i in xrange(len(body))]
+        self.assertEqual(list(iter_json_array(chunks, 'Users')), [u'J\xfcrgen'])
+
+
+class StreamingTestCase(FakeTenantTestCase):
+
+    def test_throttled_stream_does_not_leak_connections(self):
+        self.fake.throttle_rate = 0.5
+        self.fake.retry_after = 0
+        client = self.make_client(
+            AsyncClient, stream=True, max_in_flight=2, single_flight=False,
+            retry_policy=RetryPolicy(backoff=0.01, max_attempts=3)
+        )
+        outcomes = []
+        try:
+            for _ in xrange(20):
+                try:
+                    outcomes.append(len(App.search(client)))
+                except requests.HTTPError:
+                    outcomes.append(None)
+        finally:
+            client.close()
+        self.assertEqual(len(outcomes), 20)
+
+    def test_streamed_listing_matches_buffered(self):
+        client = self.make_client(stream=True)
+        try:
+            streamed = [app.fields() for app in App.iter_search(client, pagesize=3)]
+        finally:
+            client.close()
+        buffered = [app.fields() for app in App.iter_search(self.client, pagesize=3)]
+        self.assertEqual(len(streamed), 4)
+        self.assertEqual(streamed, buffered)
+
+    def test_client_closes_retried_responses(self):
+        transport = _ScriptedTransport(503, 502)
+        client = Client('http://fake', 'a', 'b', 'c', transport=transport,
+                        retry_policy=RetryPolicy(backoff=0))
+        self.assertEqual(client.call_api('GET', 'system/users/search').status_code, 200)
+        self.assertEqual([r.closed for r in transport.responses], [True, True, False])
+
+
+class OnboardingPipelineTestCase(FakeTenantTestCase):
+
+    def setUp(self):
+        super(OnboardingPipelineTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.directory, 'checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(OnboardingPipelineTestCase, self).tearDown()
+
+    def run_pipeline(self, group, usernames, **kw):
+        pipeline = OnboardingPipeline(self.client, group, **kw)
+        try:
+            return dict((r.username, r) for r in pipeline.run(usernames))
+        finally:
+            pipeline.close()
+
+    def test_every_stage_runs(self):
+        group = UserGroup.get_remote(self.client, 'group0')
+        results = self.run_pipeline(group, ['hire0', 'hire1', 'user0'])
+        self.assertEqual(set(r.stage for r in results.values()), set(['done']))
+        members = UserGroup.usernames_by_group_id(self.client, group.UserGroupId)
+        self.assertTrue(set(['hire0', 'hire1', 'user0']).issubset(members))
+
+    def test_hacked_group_replaces_smart_groups_once(self):
+        group = UserGroupHacked.get_remote(self.client, 'group0')
+        before = set(self.fake.smart_groups)
+        self.fake.reset_counters()
+        self.run_pipeline(group, ['hire{0}'.format(i) for i in xrange(5)])
+        self.assertFalse(before.intersection(self.fake.smart_groups))
+        self.assertEqual(self.requests_to('POST mdm/smartgroups/create'), 2)
+
+    def test_checkpoint_resumes_where_run_stopped(self):
+        group = UserGroup.get_remote(self.client, 'group0')
+        self.fake.error_rate = 1
+        self.client.retry_policy = NoRetry()
+        results = self.run_pipeline(group, ['hire0'], checkpoint=self.checkpoint)
+        self.assertEqual(results['hire0'].stage, 'create')
+        self.fake.error_rate = 0
+        results = self.run_pipeline(group, ['hire0'], checkpoint=self.checkpoint)
+        self.assertEqual(results['hire0'].stage, 'done')
+        self.assertFalse(results['hire0'].resumed)
+        self.fake.reset_counters()
+        results = self.run_pipeline(
+            group, ['hire0', 'hire1'], checkpoint=self.checkpoint
+        )
+        self.assertTrue(results['hire0'].resumed)
+        self.assertFalse(results['hire1'].resumed)
+        self.assertEqual(self.requests_to('POST system/users/adduser'), 1)
+
+
+class MirrorTestCase(FakeTenantTestCase):
+
+    def setUp(self):
+        super(MirrorTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'mirror.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(MirrorTestCase, self).tearDown()
+
+    def test_lookups_survive_a_restart(self):
+        self.client.mirror = TenantMirror(self.path)
+        self.assertEqual(User.get_remote(self.client, 'user3').UserName, 'user3')
+        self.client.mirror.close()
+        client = self.make_client(mirror=TenantMirror(self.path))
+        self.fake.reset_counters()
+        self.assertEqual(User.get_remote(client, 'user3').UserName, 'user3')
+        self.assertEqual(self.fake.request_count, 0)
+        self.assertEqual(User.get_remote(client, 'user3', max_age=0).UserName, 'user3')
+        self.assertEqual(self.fake.request_count, 1)
+        client.mirror.close()
+
+    def test_refresh_skips_fresh_snapshots(self):
+        mirror = TenantMirror(self.path)
+        self.assertEqual(mirror.refresh(self.client), sorted(TenantMirror.LISTINGS))
+        self.assertEqual(mirror.refresh(self.client), [])
+        self.assertEqual(mirror.refresh(self.client, ['apps'], force=True), ['apps'])
+        self.assertEqual(len(mirror.all('apps')), 4)
+        mirror.close()
+
+    def test_smart_group_edit_starts_from_tenant_copy(self):
+        self.client.mirror = TenantMirror(self.path)
+        self.client.mirror.refresh(self.client, ['smart_groups'])
+        smart_group_id = sorted(self.fake.smart_groups)[0]
+        other = SmartGroup.get_remote(self.make_client(), smart_group_id)
+        other.add_member(User.get_remote(self.client, 'user0'))
+        smart_group = SmartGroup.get_remote(self.client, smart_group_id)
+        smart_group.add_member(User.get_remote(self.client, 'user1'))
+        with SmartGroup.get_remote(self.client, smart_group_id).batch() as batch:
+            batch.add_member(User.get_remote(self.client, 'user2'))
+        names = [u['Name'] for u in self.fake.smart_groups[smart_group_id]['UserAdditions']]
+        self.assertEqual(sorted(names), ['user0', 'user1', 'user2'])
+        self.client.mirror.close()
+
+    def test_sync_members_starts_from_tenant_copy(self):
+        self.client.mirror = TenantMirror(self.path)
+        self.client.mirror.refresh(self.client, ['smart_groups'])
+        smart_group_id = sorted(self.fake.smart_groups)[0]
+        other = SmartGroup.get_remote(self.make_client(), smart_group_id)
+        other.add_member(User.get_remote(self.client, 'user0'))
+        report = SmartGroup.get_remote(self.client, smart_group_id).sync_members(
+            ['user0', 'user1'], dry_run=True
+        )
+        self.assertEqual((report.unchanged, report.added), (['user0'], ['user1']))
+        self.client.mirror.close()
+
+    def test_hacked_group_moves_apps_assigned_after_refresh(self):
+        self.client.mirror = TenantMirror(self.path)
+        self.client.mirror.refresh(self.client)
+        smart_group = self.fake.smart_groups[sorted(self.fake.smart_groups)[0]]
+        app = self.fake.add_app('late', smart_groups=[smart_group])
+        group = UserGroupHacked.get_remote(self.client, 'group0')
+        group.add_member(User.get_remote(self.client, 'user0'))
+        self.assertNotIn(smart_group['SmartGroupID'], self.fake.smart_groups)
+        self.assertEqual(len(app['SmartGroups']), 1)
+        self.assertIn(app['SmartGroups'][0]['Id'], self.fake.smart_groups)
+        self.client.mirror.close()
+
+
+class UserDirectoryTestCase(FakeTenantTestCase):
+
+    def setUp(self):
+        super(UserDirectoryTestCase, self).setUp()
+        self.directory = UserDirectory(self.client, pagesize=3)
+        self.client.user_directory = self.directory
+
+    def fake_user(self, username):
+        return [u for u in self.fake.users.values() if u['UserName'] == username][0]
+
+    def test_lookups_without_requests(self):
+        self.fake.reset_counters()
+        user = User.get_remote(self.client, 'user3')
+        self.assertEqual(user.UserName, 'user3')
+        self.assertIs(self.directory.get_by_id(user.id), user)
+        self.assertIs(self.directory.get_by_email('USER3@example.com'), user)
+        self.assertEqual(sorted(User.get_many(self.client, ['user1', 'user2'])),
+                         ['user1', 'user2'])
+        self.assertEqual(self.fake.request_count, 0)
+
+    def test_refresh_applies_the_difference(self):
+        self.fake_user('user1')['Email'] = 'renamed@example.com'
+        del self.fake.users[self.fake_user('user2')['Id']['Value']]
+        self.fake.add_user('user10')
+        self.assertEqual(
+            self.directory.refresh(), (['user10'], ['user1'], ['user2'])
+        )
+        self.assertEqual(len(self.directory), 10)
+        self.assertIsNone(self.directory.get_by_email('user1@example.com'))
+        self.assertEqual(
+            self.directory.get_by_email('renamed@example.com').UserName, 'user1'
+        )
+        self.assertEqual(self.directory.refresh(), ([], [], []))
+
+    def test_refresh_user(self):
+        self.fake_user('user1')['Status'] = True
+        self.assertTrue(self.directory.refresh_user('user1').Status)
+        del self.fake.users[self.fake_user('user1')['Id']['Value']]
+        self.assertIsNone(self.directory.refresh_user('user1'))
+        self.assertNotIn('user1', self.directory)
+
+    def test_create_and_delete_keep_directory_in_step(self):
+        user = User.create(self.client, 'hire0')
+        self.assertIs(self.directory.get('hire0'), user)
+        self.assertRaises(UserAlreadyRegisteredError, User.create, self.client, 'hire0')
+        user.delete()
+        self.assertNotIn('hire0', self.directory)
+        self.assertIsNone(self.directory.get_by_id(user.id))
+        self.assertIsNone(User.get_remote(self.client, 'hire0'))
+
+
+class SingleFlightTestCase(FakeTenantTestCase):
+
+    def call_concurrently(self, client, params_list):
+        results = []
+        threads = [
+            threading.Thread(target=lambda params=params: results.append(
+                client.call_api('GET', 'system/users/search', params=params).json()
+            ))
+            for params in params_list
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_identical_gets_share_one_request(self):
+        self.fake.latency = 0.2
+        self.fake.reset_counters()
+        results = self.call_concurrently(self.client, [None] * 4)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(self.requests_to('GET system/users/search'), 1)
+        self.assertEqual(self.client.single_flight_stats()['coalesced'], 3)
+        self.assertEqual(self.client.single_flight_stats()['in_flight'], 0)
+
+    def test_different_params_are_not_shared(self):
+        self.fake.latency = 0.2
+        self.fake.reset_counters()
+        self.call_concurrently(
+            self.client, [{'username': 'user1'}, {'username': 'user2'}]
+        )
+        self.assertEqual(self.requests_to('GET system/users/search'), 2)
+
+    def test_disabled(self):
+        client = self.make_client(single_flight=False)
+        self.fake.latency = 0.2
+        self.fake.reset_counters()
+        self.call_concurrently(client, [None] * 3)
+        self.assertEqual(self.requests_to('GET system/users/search'), 3)
+        client.close()
+
+
+class DeviceIndexTestCase(FakeTenantTestCase):
+
+    def test_search_matches_tenant(self):
+        index = DeviceIndex(self.client)
+        self.fake.reset_counters()
+        for filters in ({'platform': 'Apple'}, {'user': 'user1'},
+                        {'platform': 'Android', 'ownership': 'E'}):
+            expected = sorted(d.Id['Value'] for d in Device.search(self.client, **filters))
+            self.assertEqual(sorted(d.Id['Value'] for d in index.search(**filters)), expected)
+            self.assertEqual(index.count(**filters), len(expected))
+        self.assertEqual(len(index), 6)
+        self.assertRaises(TypeError, index.search, color='red')
+
+    def test_refresh_adds_new_devices(self):
+        index = DeviceIndex(self.client)
+        self.fake.add_device('user2', platform='Android')
+        self.assertGreaterEqual(index.refresh(), 1)
+        self.assertEqual(len(index), 7)
+        self.assertIn('Android', index.values('Platform'))
+
+    def test_refresh_updates_devices_in_place(self):
+        for day, device_id in enumerate(sorted(self.fake.devices), 1):
+            self.fake.devices[device_id]['LastSeen'] = '2014-01-0{0}T00:00:00'.format(day)
+        index = DeviceIndex(self.client, pagesize=4)
+        device = self.fake.devices[sorted(self.fake.devices)[0]]
+        device['UserName'] = 'user9'
+        device['LastSeen'] = '2014-02-01T00:00:00'
+        # the device seen last and the updated one
+        self.assertEqual(index.refresh(), 2)
+        self.assertEqual(len(index), 6)
+        self.assertEqual(index.get(device['Id']['Value']).UserName, 'user9')
+        self.assertIn(
+            device['Id']['Value'], [d.Id['Value'] for d in index.search(user='user9')]
+        )
+
+    def test_failed_load_keeps_index(self):
+        index = DeviceIndex(self.client)
+        self.client.retry_policy = NoRetry()
+        self.fake.error_rate = 1
+        self.assertRaises(requests.HTTPError, index.load)
+        self.assertEqual(len(index), 6)
+
+
+class TenantPoolTestCase(unittest.TestCase):
+
+    def tenants(self):
+        return [
+            Tenant('slow', 'http://slow', 'a', 'b', 'c', concurrency=1),
+            Tenant('fast', 'http://fast', 'a', 'b', 'c', concurrency=2),
+        ]
+
+    def test_threads_keep_tenants_within_concurrency(self):
+        lock = threading.Lock()
+        running = {'slow': 0, 'fast': 0}
+        peak = {'slow': 0, 'fast': 0}
+
+        def call(client, item):
+            name, delay = item
+            with lock:
+                running[name] += 1
+                peak[name] = max(peak[name], running[name])
+            time.sleep(delay)
+            with lock:
+                running[name] -= 1
+            return name
+
+        pool = TenantPool(self.tenants(), workers=4)
+        try:
+            results = list(pool.map(call, {
+                'slow': [('slow', 0.2)] * 3, 'fast': [('fast', 0.02)] * 16
+            }))
+        finally:
+            pool.close()
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(len(results), 19)
+        self.assertEqual(peak['slow'], 1)
+        self.assertEqual(peak['fast'], 2)
+        self.assertLess(pool.timings['fast']['finished'], 0.3)
+        self.assertEqual(pool.timings['slow']['calls'], 3)
+
+    def test_run_once_per_tenant(self):
+        pool = TenantPool(self.tenants(), workers=2)
+        try:
+            results = list(pool.run(lambda client: client.server_url))
+        finally:
+            pool.close()
+        self.assertEqual(
+            sorted(result.result for result in results),
+            ['http://fast', 'http://slow']
+        )
+
+    def test_busy_tenant_does_not_hold_processes(self):
+        pool = TenantPool(self.tenants(), workers=4, processes=True)
+        try:
+            results = list(pool.map(
+                _sleep_and_return, {'slow': [0.5] * 3, 'fast': [0.02] * 8}
+            ))
+        finally:
+            pool.close()
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(len(results), 11)
+        self.assertLess(pool.timings['fast']['finished'], 0.5)
+
+    def test_unpicklable_call_fails_instead_of_hanging(self):
+        pool = TenantPool(
+            [Tenant('only', 'http://only', 'a', 'b', 'c')], processes=True
+        )
+        try:
+            results = list(pool.map(lambda client, item: item, {'only': [1]}))
+        finally:
+            pool.close()
+        self.assertFalse(results[0].ok)
+
+
+class RequestSchedulerTestCase(unittest.TestCase):
+
+    def dispatch_order(self, scheduler, traffic_classes, pause=0):
+        scheduler.acquire('bulk')
+        order = []
+
+        def wait(traffic_class):
+            scheduler.acquire(traffic_class)
+            order.append(traffic_class)
+            scheduler.release()
+        threads = []
+        for traffic_class in traffic_classes:
+            threads.append(threading.Thread(target=wait, args=(traffic_class, )))
+            threads[-1].start()
+            while scheduler.stats()[traffic_class]['queued'] == 0:
+                time.sleep(0.001)
+            time.sleep(pause)
+        scheduler.release()
+        for thread in threads:
+            thread.join()
+        return order
+
+    def test_most_urgent_waiter_first(self):
+        scheduler = RequestScheduler(slots=1, aging=None)
+        self.assertEqual(
+            self.dispatch_order(scheduler, ('bulk', 'default', 'interactive')),
+            ['interactive', 'default', 'bulk']
+        )
+        self.assertEqual(scheduler.stats()['bulk']['dispatched'], 2)
+
+    def test_long_wait_counts_as_a_class_up(self):
+        scheduler = RequestScheduler(slots=1, aging=0.05)
+        self.assertEqual(
+            self.dispatch_order(scheduler, ('bulk', 'interactive'), pause=0.15),
+            ['bulk', 'interactive']
+        )
+
+    def test_unknown_class(self):
+        self.assertRaises(ValueError, RequestScheduler().acquire, 'urgent')
+        self.assertRaises(ValueError, RequestScheduler, slots=0)
+
+
+class TrafficClassTestCase(FakeTenantTestCase):
+
+    def test_priority_reaches_async_workers(self):
+        client = self.make_client(AsyncClient, scheduler=RequestScheduler(2))
+        try:
+            with client.priority('bulk'):
+                client.gather([
+                    client.call_api_async('GET', 'system/users/search'),
+                    App.search_async(client),
+                ])
+            client.call_api_async('GET', 'system/users/search').result()
+            stats = client.scheduler.stats()
+            self.assertEqual(stats['bulk']['dispatched'], 2)
+            self.assertEqual(stats['default']['dispatched'], 1)
+        finally:
+            client.close()
+
+    def test_priority_argument(self):
+        client = self.make_client(scheduler=RequestScheduler(2))
+        client.call_api('GET', 'system/users/search', priority='interactive')
+        self.assertEqual(client.scheduler.stats()['interactive']['dispatched'], 1)
+        client.close()
+
+
+class RecordReplayTestCase(FakeTenantTestCase):
+
+    def setUp(self):
+        super(RecordReplayTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'capture.jsonl.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(RecordReplayTestCase, self).tearDown()
+
+    def record(self, func):
+        recording = RecordingTransport(self.path, self.client.transport)
+        self.client.transport = recording
+        try:
+            return func()
+        finally:
+            recording.close()
+
+    def test_replay_answers_without_tenant(self):
+        recorded = self.record(
+            lambda: sorted(u.UserName for u in User.iter_search(self.client))
+        )
+        client = self.make_client(transport=ReplayTransport(self.path, strict=True))
+        self.fake.reset_counters()
+        self.assertEqual(sorted(u.UserName for u in User.iter_search(client)), recorded)
+        self.assertEqual(self.fake.request_count, 0)
+        self.assertRaises(ReplayMissError, client.call_api, 'GET', 'mam/apps/search')
+
+    def test_credentials_are_scrubbed(self):
+        self.record(lambda: User.get_remote(self.client, 'user1'))
+        entries = list(iter_capture(self.path))
+        self.assertTrue(entries)
+        for entry in entries:
+            headers = dict(
+                (name.lower(), value) for name, value in entry['request_headers'].items()
+            )
+            self.assertEqual(headers['authorization'], '***')
+            self.assertEqual(headers['aw-tenant-code'], '***')
+        self.assertEqual(summarize(self.path), {'GET system/users/search': len(entries)})
+
+    def test_identical_requests_replay_in_order(self):
+        def search(client):
+            return [u.UserName for u in User.iter_search(client, username='hire')]
+        self.record(lambda: (
+            search(self.client), self.fake.add_user('hire0'), search(self.client)
+        ))
+        for strict in (True, False):
+            client = self.make_client(transport=ReplayTransport(self.path, strict=strict))
+            self.assertEqual(search(client), [])
+            self.assertEqual(search(client), ['hire0'])
+            if strict:
+                self.assertRaises(ReplayMissError, search, client)
+            else:
+                self.assertEqual(search(client), ['hire0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Transports send the HTTP requests of a Client: anything with the
+`request(method, url, **kw)` method of `requests.Session`, which is the
+default. RecordingTransport captures the traffic to a JSON lines file
+(gzip compressed when the path ends with `.gz`) and ReplayTransport
+serves a capture back without a tenant:
+
+    client.transport = RecordingTransport('capture.jsonl.gz', client.transport)
+    client.transport = ReplayTransport('capture.jsonl.gz', speed=1.0)
+"""
+
+import base64
+import datetime
+import gzip
+import json
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+from metrics import endpoint_template
+
+
+SENSITIVE_HEADERS = frozenset(['authorization', 'aw-tenant-code', 'cookie', 'set-cookie'])
+SCRUBBED = '***'
+
+_API_PREFIX = '/API/v1/'
+
+
+class ReplayMissError(LookupError):
+    pass
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def scrub_headers(headers):
+    return dict(
+        (name, SCRUBBED if name.lower() in SENSITIVE_HEADERS else value)
+        for name, value in (headers or {}).items()
+    )
+
+
+def endpoint_of(url):
+    return url.split(_API_PREFIX, 1)[-1]
+
+
+def _key(method, endpoint, params, data):
+    return (
+        method.upper(), endpoint.strip('/'),
+        json.dumps(params or {}, sort_keys=True), data or None
+    )
+
+
+def iter_capture(path):
+    with _open(path, 'rb') as capture:
+        for line in capture:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # the last line of an interrupted capture may be cut short
+                continue
+
+
+def summarize(path):
+    """Requests of a capture counted by `METHOD endpoint template`."""
+    return Counter(
+        '{0} {1}'.format(entry['method'], endpoint_template(entry['endpoint']))
+        for entry in iter_capture(path)
+    )
+
+
+class RecordingTransport(object):
+    """
+    Send through `transport` and append every exchange to `path`: the
+    request, the response status, headers and body, the time it started
+    and how long it took. Credentials in headers are scrubbed.
+    """
+
+    def __init__(self, path, transport):
+        self.path = path
+        self.transport = transport
+        self.requests = Counter()
+        self._started = time.time()
+        self._lock = threading.Lock()
+        self._file = _open(path, 'ab')
+
+    def request(self, method, url, **kw):
+        started = time.time()
+        response = self.transport.request(method, url, **kw)
+        elapsed = time.time() - started
+        # read now so the body can be recorded, streaming callers then
+        # iterate over the content already in memory
+        content = response.content or ''
+        sent = getattr(response, 'request', None)
+        entry = {
+            'offset': started - self._started,
+            'elapsed': elapsed,
+            'method': method.upper(),
+            'endpoint': endpoint_of(url),
+            'params': kw.get('params') or {},
+            'data': kw.get('data'),
+            'request_headers': scrub_headers(getattr(sent, 'headers', None)),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': scrub_headers(response.headers),
+        }
+        try:
+            entry['text'] = content.decode('utf-8')
+        except UnicodeDecodeError:
+            entry['content'] = base64.b64encode(content)
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self.requests['{0} {1}'.format(
+                entry['method'], endpoint_template(entry['endpoint'])
+            )] += 1
+        return response
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class ReplayTransport(object):
+    """
+    Answer requests from a capture. Identical requests get their recorded
+    responses in recorded order, then the last one again; with `strict` a
+    request beyond the capture raises ReplayMissError instead. `speed`
+    1.0 replays at the recorded latency, 2.0 twice as fast, None as fast
+    as possible. `requests` and `misses` count what was asked for.
+    """
+
+    def __init__(self, path, speed=None, strict=False):
+        self.path = path
+        self.speed = speed
+        self.strict = strict
+        self.requests = Counter()
+        self.misses = Counter()
+        self._responses = defaultdict(deque)
+        self._last = {}
+        self._lock = threading.Lock()
+        for entry in iter_capture(path):
+            key = _key(entry['method'], entry['endpoint'], entry['params'], entry['data'])
+            self._responses[key].append(entry)
+
+    def _next(self, key):
+        with self._lock:
+            queue = self._responses.get(key)
+            if queue:
+                entry = self._last[key] = queue.popleft()
+                return entry
+            if not self.strict:
+                return self._last.get(key)
+        return None
+
+    def request(self, method, url, **kw):
+        endpoint = endpoint_of(url)
+        name = '{0} {1}'.format(method.upper(), endpoint_template(endpoint))
+        entry = self._next(_key(method, endpoint, kw.get('params'), kw.get('data')))
+        with self._lock:
+            self.requests[name] += 1
+            if entry is None:
+                self.misses[name] += 1
+        if entry is None:
+            raise ReplayMissError('{0} {1} params={2!r} is not in {3}'.format(
+                method.upper(), endpoint, kw.get('params'), self.path
+            ))
+        if self.speed:
+            time.sleep(entry['elapsed'] / self.speed)
+        response = Response()
+        response.status_code = entry['status']
+        response.reason = entry['reason']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.url = url
+        response.encoding = 'utf-8'
+        response.elapsed = datetime.timedelta(seconds=entry['elapsed'])
+        if 'text' in entry:
+            response._content = entry['text'].encode('utf-8')
+        else:
+            response._content = base64.b64decode(entry['content'])
+        response._content_consumed = True
+        return response
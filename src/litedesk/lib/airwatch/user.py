@@ -15,7 +15,10 @@
 # limitations under the License.
 
 
-from base import BaseObject, check_response
+from collections import OrderedDict
+
+from base import BaseObject, DEFAULT_PAGE_SIZE, PackedId, check_response
+from concurrency import WorkerPool, deferred, map_bounded
 
 
 class UserAlreadyRegisteredError(Exception):
@@ -38,33 +41,204 @@ class UserNotActiveError(Exception):
     RESPONSE_MESSAGE = 'User is already inactive.'
 
 
+class UserNotFoundError(Exception):
+    pass
+
+
+class UserResult(object):
+    """
+    Outcome of one user in a batch call: either `user` is set or `error`
+    holds the exception raised for that user.
+    """
+
+    def __init__(self, username, user=None, error=None):
+        self.username = username
+        self.user = user
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<UserResult {0} {1}>'.format(
+            self.username, 'ok' if self.ok else repr(self.error)
+        )
+
+
 class User(BaseObject):
+    FIELDS = ('Id', 'UserName', 'Email', 'Status', 'FirstName', 'LastName', 'SecurityType')
+    __slots__ = ('_id', ) + FIELDS[1:]
+
+    Id = PackedId()
+
+    # up to this many usernames get_many looks up one by one instead of
+    # listing the whole tenant
+    LOOKUP_LIMIT = 20
 
     @classmethod
     def create(cls, client, username):
-        if cls.get_remote(client, username) is not None:
+        # a user directory is kept up to date by this process, a mirror
+        # may be stale so it is not trusted to check existence
+        directory = getattr(client, 'user_directory', None)
+        if directory is not None:
+            exists = username in directory
+        else:
+            exists = cls.get_remote(client, username, max_age=0) is not None
+        if exists:
             raise UserAlreadyRegisteredError
 
+        cls._add_user(client, username)
+        user = cls.get_remote(client, username, max_age=0)
+        if directory is not None and user is not None:
+            directory.put(user)
+        return user
+
+    @staticmethod
+    def _add_user(client, username):
         endpoint = 'system/users/adduser'
         response = client.call_api('POST', endpoint, data={
             'username': username,
             'SecurityType': 'directory',
             })
         response.raise_for_status()
-        return cls.get_remote(client, username)
+        return response
 
     @classmethod
-    def get_remote(cls, client, username):
-        endpoint = 'system/users/search'
-        response = client.call_api('GET', endpoint, params={'username': username})
-        response.raise_for_status()
-        if response.status_code == 204:
-            return None
+    def iter_search(cls, client, pagesize=DEFAULT_PAGE_SIZE, prefetch=False, **kwargs):
+        return cls._iter_search(
+            client, 'system/users/search', 'Users', kwargs, pagesize, prefetch
+        )
+
+    @classmethod
+    def get_remote(cls, client, username, max_age=None):
+        """
+        With a `client.user_directory` the user is read from it. Otherwise,
+        with a `client.mirror`, it is read from the mirror when stored less
+        than `max_age` seconds (the mirror's default when None) ago.
+        `max_age=0` always asks the tenant.
+        """
+        directory = getattr(client, 'user_directory', None)
+        if directory is not None and max_age != 0:
+            return directory.get(username)
+        mirror = getattr(client, 'mirror', None)
+        if mirror is not None:
+            attrs = mirror.get('users', username, max_age)
+            if attrs is not None:
+                return cls(client, **attrs)
+        # the search matches on substrings, so look for the exact username
+        for user in cls.iter_search(client, username=username):
+            if getattr(user, 'UserName', None) == username:
+                user._remember('users', username)
+                return user
+        return None
+
+    @classmethod
+    def _run_many(cls, client, usernames, func, concurrency):
+        # duplicates are processed once, results keep the input order
+        usernames = list(OrderedDict.fromkeys(usernames))
+        results = {}
+        pool = WorkerPool(concurrency)
         try:
-            users = [u for u in response.json().get('Users') if u.get('UserName') == username]
-            return cls(client, **users.pop())
-        except IndexError:
-            return None
+            for username, future in pool.imap_unordered(func, usernames):
+                error = future.exception()
+                results[username] = UserResult(
+                    username,
+                    user=future.result() if error is None else None,
+                    error=error
+                )
+        finally:
+            pool.shutdown()
+        return [results[username] for username in usernames]
+
+    @classmethod
+    def create_many(cls, client, usernames, concurrency=8):
+        """
+        Check which users exist up front with `get_many`, then add only
+        the missing ones. The users returned are built from the request and
+        the id the API answers with, without searching for them again.
+        """
+        existing = cls.get_many(client, usernames, max_age=0)
+        directory = getattr(client, 'user_directory', None)
+
+        def create(username):
+            if username in existing:
+                raise UserAlreadyRegisteredError(username)
+            response = cls._add_user(client, username)
+            user = cls(client, UserName=username, SecurityType='directory')
+            try:
+                body = response.json()
+            except ValueError:
+                body = None
+            user_id = body.get('Value') if isinstance(body, dict) else body
+            if user_id is not None:
+                user.Id = {'Value': user_id}
+                if directory is not None:
+                    directory.put(user)
+            return user
+        return cls._run_many(client, usernames, create, concurrency)
+
+    @classmethod
+    def _run_many_existing(cls, client, usernames, action, concurrency):
+        # the users are resolved with one listing instead of a search each
+        existing = cls.get_many(client, usernames)
+
+        def run(username):
+            user = existing.get(username)
+            if user is None:
+                raise UserNotFoundError(username)
+            action(user)
+            return user
+        return cls._run_many(client, usernames, run, concurrency)
+
+    @classmethod
+    def activate_many(cls, client, usernames, concurrency=8):
+        return cls._run_many_existing(client, usernames, cls.activate, concurrency)
+
+    @classmethod
+    def deactivate_many(cls, client, usernames, concurrency=8):
+        return cls._run_many_existing(client, usernames, cls.deactivate, concurrency)
+
+    @classmethod
+    def delete_many(cls, client, usernames, concurrency=8):
+        return cls._run_many_existing(client, usernames, cls.delete, concurrency)
+
+    @classmethod
+    def get_many(cls, client, usernames, max_age=None, concurrency=8):
+        """
+        Resolve many usernames with one paged user listing, or with
+        `get_remote` for each of them, `concurrency` at a time, when there
+        are no more than LOOKUP_LIMIT. Returns a dict of username to User
+        for the users that exist.
+        """
+        wanted = set(usernames)
+        found = {}
+        if not wanted:
+            return found
+        directory = getattr(client, 'user_directory', None)
+        if directory is not None:
+            for username in wanted:
+                user = directory.get(username)
+                if user is not None:
+                    found[username] = user
+            return found
+        if len(wanted) <= cls.LOOKUP_LIMIT:
+            wanted = list(wanted)
+            users = map_bounded(
+                lambda username: cls.get_remote(client, username, max_age),
+                wanted, concurrency
+            )
+            return dict(
+                (username, user)
+                for username, user in zip(wanted, users) if user is not None
+            )
+        for user in cls.iter_search(client):
+            username = getattr(user, 'UserName', None)
+            if username in wanted:
+                found[username] = user
+                if len(found) == len(wanted):
+                    break
+        return found
 
     def _get_id(self):
         if getattr(self, 'Id'): return self.Id.get('Value')
@@ -78,12 +252,16 @@ class User(BaseObject):
         endpoint = 'system/users/{0}/activate'.format(self.id)
         response = self._client.call_api('POST', endpoint)
         response.raise_for_status()
+        self.Status = True
+        self._changed()
 
     @check_response(UserNotActiveError)
     def deactivate(self):
         endpoint = 'system/users/{0}/deactivate'.format(self.id)
         response = self._client.call_api('POST', endpoint)
         response.raise_for_status()
+        self.Status = False
+        self._changed()
 
     @check_response(UserAlreadyEnrolledError)
     def add_to_group(self, group_id):
@@ -101,5 +279,23 @@ class User(BaseObject):
         endpoint = 'system/users/%s/delete' % (self.id, )
         response = self._client.call_api('DELETE', endpoint)
         response.raise_for_status()
+        self._forget('users', self.UserName)
+        directory = getattr(self._client, 'user_directory', None)
+        if directory is not None:
+            directory.discard(self.UserName)
+
+    def _changed(self):
+        self._remember('users', self.UserName)
+        directory = getattr(self._client, 'user_directory', None)
+        if directory is not None:
+            directory.put(self)
 
     id = property(_get_id, _set_id)
+
+    create_async = deferred('create')
+    get_remote_async = deferred('get_remote')
+    activate_async = deferred('activate')
+    deactivate_async = deferred('deactivate')
+    add_to_group_async = deferred('add_to_group')
+    remove_from_group_async = deferred('remove_from_group')
+    delete_async = deferred('delete')
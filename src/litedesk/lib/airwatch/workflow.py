@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+
+# Copyright 2014, Deutsche Telekom AG - Laboratories (T-Labs)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import sys
+import threading
+import Queue
+
+from device import Device
+from user import (
+    User, UserAlreadyActivatedError, UserAlreadyEnrolledError,
+    UserAlreadyRegisteredError, UserNotFoundError
+)
+
+
+_DONE = object()
+
+
+class OnboardingResult(object):
+    """
+    Outcome of one hire: `stage` is the stage that failed with `error`, or
+    'done' once every stage went through. `resumed` is set for hires a
+    checkpoint had already finished.
+    """
+
+    def __init__(self, username, stage, user=None, error=None, resumed=False):
+        self.username = username
+        self.stage = stage
+        self.user = user
+        self.error = error
+        self.resumed = resumed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<OnboardingResult {0} {1}{2}>'.format(
+            self.username, self.stage,
+            '' if self.ok else ' ' + repr(self.error)
+        )
+
+
+class Checkpoint(object):
+    """
+    Append-only JSON lines file of the stages each hire has completed or
+    failed. Loading it again tells a restarted run where every hire stopped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._completed = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                for line in checkpoint_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line of a crashed run may be cut short
+                        continue
+                    if entry.get('error') is None:
+                        self._completed.setdefault(
+                            entry['username'], set()
+                        ).add(entry['stage'])
+        self._file = open(path, 'a')
+
+    def completed(self, username):
+        with self._lock:
+            return frozenset(self._completed.get(username, ()))
+
+    def _write(self, entry):
+        with self._lock:
+            if entry.get('error') is None:
+                self._completed.setdefault(
+                    entry['username'], set()
+                ).add(entry['stage'])
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+
+    def done(self, username, stage):
+        self._write({'username': username, 'stage': stage})
+
+    def failed(self, username, stage, error):
+        self._write({'username': username, 'stage': stage, 'error': repr(error)})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class _Hire(object):
+    __slots__ = ('username', 'user', 'completed')
+
+    def __init__(self, username, completed):
+        self.username = username
+        self.user = None
+        self.completed = completed
+
+
+class OnboardingPipeline(object):
+    """
+    Onboard a stream of usernames through create, activate, add to `group`
+    and install `apps` on the hire's devices. Every stage runs its own
+    workers, `concurrency` maps stage names to their count, and hires move
+    on through bounded queues as soon as a stage is done with them, so all
+    stages work at once. Errors saying a stage was already done count as
+    success; with a `checkpoint` path a rerun skips what was completed.
+    A UserGroupHacked `group` replaces its smart groups once, after the
+    last hire went through add_to_group.
+    """
+
+    STAGES = ('create', 'activate', 'add_to_group', 'install_apps')
+    DEFAULT_CONCURRENCY = 4
+
+    def __init__(self, client, group=None, apps=(), checkpoint=None,
+                 concurrency=None):
+        self._client = client
+        self.group = group
+        self.apps = list(apps)
+        self.checkpoint = Checkpoint(checkpoint) if checkpoint else None
+        self.concurrency = dict(
+            (stage, self.DEFAULT_CONCURRENCY) for stage in self.STAGES
+        )
+        self.concurrency.update(concurrency or {})
+        self.stages = [
+            stage for stage in self.STAGES
+            if (stage != 'add_to_group' or group is not None) and
+            (stage != 'install_apps' or self.apps)
+        ]
+
+    def _get_user(self, hire):
+        if hire.user is None:
+            user = User.get_remote(self._client, hire.username)
+            if user is None:
+                raise UserNotFoundError(hire.username)
+            hire.user = user
+        return hire.user
+
+    def _create(self, hire):
+        try:
+            hire.user = User.create(self._client, hire.username)
+        except UserAlreadyRegisteredError:
+            pass
+
+    def _activate(self, hire):
+        try:
+            self._get_user(hire).activate()
+        except UserAlreadyActivatedError:
+            pass
+
+    def _add_to_group(self, hire):
+        # straight to the membership call: listing the group for every
+        # hire like UserGroup.add_member does would not scale
+        user = self._get_user(hire)
+        try:
+            user.add_to_group(self.group.UserGroupId)
+        except UserAlreadyEnrolledError:
+            pass
+        else:
+            self._group_changed = True
+
+    def _finish_add_to_group(self):
+        # the membership calls skip add_member, so a UserGroupHacked gets
+        # its smart groups replaced once for the whole stage instead
+        schedule = getattr(self.group, '_schedule_replacement', None)
+        if self._group_changed and schedule is not None:
+            schedule()
+
+    def _install_apps(self, hire):
+        devices = Device.search(self._client, user=hire.username)
+        for app in self.apps:
+            for device in devices:
+                if not app.is_installed_on_device(device):
+                    app.install(device)
+
+    def _record(self, hire, stage, error=None):
+        if self.checkpoint is not None:
+            if error is None:
+                self.checkpoint.done(hire.username, stage)
+            else:
+                self.checkpoint.failed(hire.username, stage, error)
+
+    def _feed(self, usernames, inbox, results, workers, failure):
+        seen = set()
+        try:
+            for username in usernames:
+                if username in seen:
+                    continue
+                seen.add(username)
+                completed = (
+                    self.checkpoint.completed(username)
+                    if self.checkpoint is not None else frozenset()
+                )
+                if completed.issuperset(self.stages):
+                    results.put(OnboardingResult(username, 'done', resumed=True))
+                    continue
+                inbox.put(_Hire(username, completed))
+        except Exception:
+            failure.append(sys.exc_info())
+        finally:
+            for _ in xrange(workers):
+                inbox.put(_DONE)
+
+    def _work(self, stage, inbox, outbox, results, running, next_workers,
+              failure):
+        func = getattr(self, '_' + stage)
+        finish = getattr(self, '_finish_' + stage, None)
+        while True:
+            hire = inbox.get()
+            if hire is _DONE:
+                with running['lock']:
+                    running[stage] -= 1
+                    last = not running[stage]
+                if last:
+                    try:
+                        if finish is not None:
+                            finish()
+                    except Exception:
+                        failure.append(sys.exc_info())
+                    finally:
+                        for _ in xrange(next_workers):
+                            outbox.put(_DONE)
+                return
+            if stage not in hire.completed:
+                try:
+                    func(hire)
+                except Exception, e:
+                    self._record(hire, stage, e)
+                    results.put(OnboardingResult(
+                        hire.username, stage, hire.user, error=e
+                    ))
+                    continue
+                self._record(hire, stage)
+            outbox.put(hire)
+
+    def run(self, usernames):
+        """
+        Onboard `usernames`, any iterable, and yield an OnboardingResult
+        per hire as each one finishes or fails.
+        """
+        results = Queue.Queue()
+        running = {'lock': threading.Lock()}
+        queues = []
+        for stage in self.stages:
+            running[stage] = max(1, self.concurrency[stage])
+            queues.append(Queue.Queue(maxsize=2 * running[stage]))
+        queues.append(results)
+        failure = []
+        self._group_changed = False
+        threads = [threading.Thread(
+            target=self._feed,
+            args=(usernames, queues[0], results, running[self.stages[0]], failure)
+        )]
+        for index, stage in enumerate(self.stages):
+            next_workers = (
+                running[self.stages[index + 1]]
+                if index + 1 < len(self.stages) else 1
+            )
+            for _ in xrange(running[stage]):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[index], queues[index + 1], results,
+                          running, next_workers, failure)
+                ))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Hire):
+                item = OnboardingResult(item.username, 'done', item.user)
+            yield item
+        if failure:
+            raise failure[0][0], failure[0][1], failure[0][2]
+
+    def close(self):
+        if self.checkpoint is not None:
+            self.checkpoint.close()